@@ -1,8 +1,16 @@
 import json
 import os
+import sys
 import time
 import re
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from data_processing.entity_matcher import get_matcher
+from data_processing.chunk_io import JsonlWriter
+
+ENHANCED_DATA_PATH = "processed_data/enhanced_raw_data.jsonl"
+ENHANCED_CHUNKS_PATH = "processed_data/enhanced_chunks.jsonl"
 
 class ZJUHistoryDataCollector:
     def __init__(self):
@@ -10,8 +18,12 @@ class ZJUHistoryDataCollector:
         
     def load_local_documents(self) -> List[Dict]:
         """加载本地文档资料"""
-        documents = []
-        
+        documents = list(self.iter_local_documents())
+        print(f"📊 总共加载 {len(documents)} 个文档")
+        return documents
+    
+    def iter_local_documents(self) -> Iterator[Dict]:
+        """逐个读取本地文档，读到一个产出一个"""
         # 定义要处理的文档
         local_files = {
             "zju_history.txt": "校史概述",
@@ -28,14 +40,14 @@ class ZJUHistoryDataCollector:
                         content = f.read()
                     
                     if content.strip():
-                        documents.append({
+                        print(f"✅ 成功读取: {filename} ({len(content)} 字符)")
+                        yield {
                             "type": doc_type,
                             "filename": filename,
                             "content": content,
                             "source": "本地文档",
                             "collected_time": time.strftime("%Y-%m-%d %H:%M:%S")
-                        })
-                        print(f"✅ 成功读取: {filename} ({len(content)} 字符)")
+                        }
                     else:
                         print(f"⚠️ 文件为空: {filename}")
                 else:
@@ -43,9 +55,6 @@ class ZJUHistoryDataCollector:
                     
             except Exception as e:
                 print(f"❌ 读取文件 {filename} 失败: {e}")
-        
-        print(f"📊 总共加载 {len(documents)} 个文档")
-        return documents
 
 class DataEnhancer:
     def __init__(self):
@@ -55,13 +64,16 @@ class DataEnhancer:
         """增强现有数据"""
         print("🔧 开始数据增强处理...")
         
-        for item in raw_data:
-            enhanced_item = self._enhance_single_item(item)
-            self.enhanced_data.append(enhanced_item)
+        self.enhanced_data.extend(self.iter_enhanced(raw_data))
         
         print(f"✅ 数据增强完成，共处理 {len(self.enhanced_data)} 条数据")
         return self.enhanced_data
     
+    def iter_enhanced(self, raw_data: Iterable[Dict]) -> Iterator[Dict]:
+        """逐条增强数据，不在内存中累积结果"""
+        for item in raw_data:
+            yield self._enhance_single_item(item)
+    
     def _enhance_single_item(self, item: Dict) -> Dict:
         """增强单个数据项"""
         content = item.get('content', '')
@@ -119,40 +131,22 @@ class DataEnhancer:
         if current_para:
             paragraphs.append('。'.join(current_para) + '。')
         
+        entities = get_matcher().extract(content)
         return {
             "sentences": sentences,
             "paragraphs": paragraphs,
             "time_periods": re.findall(r'\d{4}年', content),
-            "key_figures": self._extract_figures(content),
-            "locations": self._extract_locations(content)
+            "key_figures": entities["persons"],
+            "locations": entities["locations"]
         }
     
     def _extract_figures(self, content: str) -> List[str]:
         """提取人物姓名"""
-        zju_figures = ["竺可桢", "林启", "蒋梦麟", "陈建功", "苏步青", "束星北", 
-                      "贝时璋", "蔡邦华", "马一浮", "丰子恺", "钱穆", "王淦昌",
-                      "谈家桢", "李政道", "程开甲", "谷超豪", "叶笃正", "李约瑟",
-                      "邵飘萍", "何燏时", "蒋方震", "费巩", "于子三", "马寅初"]
-        
-        found_figures = []
-        for figure in zju_figures:
-            if figure in content:
-                found_figures.append(figure)
-        
-        return found_figures
+        return get_matcher().extract(content)["persons"]
     
     def _extract_locations(self, content: str) -> List[str]:
         """提取地点"""
-        zju_locations = ["杭州", "建德", "吉安", "泰和", "宜山", "遵义", "湄潭",
-                        "天目山", "禅源寺", "紫金港", "玉泉", "之江", "华家池",
-                        "龙泉", "松木场", "湖滨", "舟山", "海宁", "宁波"]
-        
-        found_locations = []
-        for location in zju_locations:
-            if location in content:
-                found_locations.append(location)
-        
-        return found_locations
+        return get_matcher().extract(content)["locations"]
     
     def _extract_key_topics(self, content: str) -> List[str]:
         """提取关键主题"""
@@ -193,26 +187,28 @@ class AdvancedChunker:
     
     def chunk_enhanced_data(self, enhanced_data: List[Dict]) -> List[Dict]:
         """对增强数据进行智能分块"""
-        chunks = []
-        
-        for item in enhanced_data:
-            structured = item.get('structured_data', {})
-            paragraphs = structured.get('paragraphs', [])
-            
-            for i, paragraph in enumerate(paragraphs):
-                # 如果段落太长，进一步分割
-                if len(paragraph) > self.chunk_size:
-                    sub_chunks = self._split_long_paragraph(paragraph)
-                    for j, sub_chunk in enumerate(sub_chunks):
-                        chunk = self._create_chunk(item, sub_chunk, i, j)
-                        chunks.append(chunk)
-                else:
-                    chunk = self._create_chunk(item, paragraph, i)
-                    chunks.append(chunk)
-        
+        chunks = list(self.iter_chunks(enhanced_data))
         print(f"✅ 分块完成，共生成 {len(chunks)} 个文本块")
         return chunks
     
+    def iter_chunks(self, enhanced_data: Iterable[Dict]) -> Iterator[Dict]:
+        """逐条对增强数据分块并产出文本块"""
+        for item in enhanced_data:
+            yield from self.chunk_single_item(item)
+    
+    def chunk_single_item(self, item: Dict) -> Iterator[Dict]:
+        structured = item.get('structured_data', {})
+        paragraphs = structured.get('paragraphs', [])
+        
+        for i, paragraph in enumerate(paragraphs):
+            # 如果段落太长，进一步分割
+            if len(paragraph) > self.chunk_size:
+                sub_chunks = self._split_long_paragraph(paragraph)
+                for j, sub_chunk in enumerate(sub_chunks):
+                    yield self._create_chunk(item, sub_chunk, i, j)
+            else:
+                yield self._create_chunk(item, paragraph, i)
+    
     def _split_long_paragraph(self, paragraph: str) -> List[str]:
         """分割长段落"""
         sentences = re.split(r'[。！？]', paragraph)
@@ -247,6 +243,7 @@ class AdvancedChunker:
         if sub_index is not None:
             chunk_id += f"_s{sub_index}"
         
+        entities = get_matcher().extract(content)
         return {
             "id": chunk_id,
             "content": content,
@@ -257,79 +254,76 @@ class AdvancedChunker:
             "key_topics": item.get('key_topics', []),
             "word_count": len(content),
             "time_periods": re.findall(r'\d{4}年', content),
-            "figures": self._extract_figures_from_chunk(content),
-            "locations": self._extract_locations_from_chunk(content),
+            "figures": entities["persons"],
+            "locations": entities["locations"],
             "chunk_timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }
     
     def _extract_figures_from_chunk(self, content: str) -> List[str]:
         """从块中提取人物"""
-        figures = ["竺可桢", "林启", "蒋梦麟", "陈建功", "苏步青", "束星北", 
-                  "贝时璋", "蔡邦华", "马一浮", "丰子恺", "钱穆", "王淦昌",
-                  "谈家桢", "李政道", "程开甲", "谷超豪", "叶笃正", "李约瑟"]
-        
-        return [f for f in figures if f in content]
+        return get_matcher().extract(content)["persons"]
     
     def _extract_locations_from_chunk(self, content: str) -> List[str]:
         """从块中提取地点"""
-        locations = ["杭州", "建德", "吉安", "泰和", "宜山", "遵义", "湄潭",
-                    "天目山", "禅源寺", "紫金港", "玉泉", "之江", "华家池"]
-        
-        return [l for l in locations if l in content]
+        return get_matcher().extract(content)["locations"]
 
 def main():
     """主函数：执行完整的数据增强流程"""
     print("🚀 开始浙大校史数据增强流程...")
     
-    # 1. 数据收集
+    # 1~3. 加载、增强、分块串成流水线：每读入一个文档就完成增强与分块并写出，内存中只保留当前文档
     collector = ZJUHistoryDataCollector()
-    print("📥 阶段1: 加载本地文档")
-    local_data = collector.load_local_documents()
-    
-    if not local_data:
-        print("❌ 没有找到可处理的文档，请检查 raw_data/documents/ 目录")
-        return
-    
-    # 2. 数据增强
-    print("🔧 阶段2: 数据增强")
     enhancer = DataEnhancer()
-    enhanced_data = enhancer.enhance_existing_data(local_data)
+    chunker = AdvancedChunker()
+    print("📥 阶段1~3: 加载本地文档 → 数据增强 → 智能分块（流水线）")
     
-    # 保存增强数据
-    os.makedirs("processed_data", exist_ok=True)
-    with open("processed_data/enhanced_raw_data.json", "w", encoding="utf-8") as f:
-        json.dump(enhanced_data, f, ensure_ascii=False, indent=2)
+    document_count = 0
+    chunk_count = 0
+    total_words = 0
+    total_figures = 0
+    total_locations = 0
+    high_quality_chunks = 0
     
-    # 3. 智能分块
-    print("✂️ 阶段3: 智能分块")
-    chunker = AdvancedChunker()
-    chunks = chunker.chunk_enhanced_data(enhanced_data)
+    with JsonlWriter(ENHANCED_DATA_PATH) as data_writer, JsonlWriter(ENHANCED_CHUNKS_PATH) as chunk_writer:
+        for item in enhancer.iter_enhanced(collector.iter_local_documents()):
+            data_writer.write(item)
+            document_count += 1
+            for chunk in chunker.chunk_single_item(item):
+                chunk_writer.write(chunk)
+                chunk_count += 1
+                total_words += chunk['word_count']
+                total_figures += len(chunk['figures'])
+                total_locations += len(chunk['locations'])
+                if chunk.get('enhancement_level') == '高质量':
+                    high_quality_chunks += 1
+        if not document_count:
+            # 没有可处理的文档时保留原有输出文件
+            data_writer.discard()
+            chunk_writer.discard()
     
-    # 保存分块数据
-    with open("processed_data/enhanced_chunks.json", "w", encoding="utf-8") as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+    if not document_count:
+        print("❌ 没有找到可处理的文档，请检查 raw_data/documents/ 目录")
+        return
+    print(f"✅ 数据增强与分块完成，共处理 {document_count} 个文档，生成 {chunk_count} 个文本块")
     
     # 4. 统计信息
-    total_words = sum(chunk['word_count'] for chunk in chunks)
-    total_figures = sum(len(chunk['figures']) for chunk in chunks)
-    total_locations = sum(len(chunk['locations']) for chunk in chunks)
-    avg_chunk_size = total_words / len(chunks) if chunks else 0
+    avg_chunk_size = total_words / chunk_count if chunk_count else 0
     
     print(f"""
 🎉 数据增强完成！
 
 📈 统计信息:
-├── 原始文档: {len(local_data)} 个
-├── 生成文本块: {len(chunks)} 个
+├── 原始文档: {document_count} 个
+├── 生成文本块: {chunk_count} 个
 ├── 总字数: {total_words} 字
 ├── 涉及人物: {total_figures} 次
 ├── 涉及地点: {total_locations} 次
 ├── 平均块大小: {avg_chunk_size:.1f} 字
-└── 高质量块: {sum(1 for c in chunks if c.get('enhancement_level') == '高质量')} 个
+└── 高质量块: {high_quality_chunks} 个
 
 💾 输出文件:
-├── processed_data/enhanced_raw_data.json (增强的原始数据)
-└── processed_data/enhanced_chunks.json (智能分块数据)
+├── {ENHANCED_DATA_PATH} (增强的原始数据，JSON Lines)
+└── {ENHANCED_CHUNKS_PATH} (智能分块数据，JSON Lines)
 
 接下来请运行: python rebuild_vector_db.py
     """)
@@ -1,34 +1,221 @@
 import re
+import sys
+import glob
 import json
 import os
-from typing import List, Dict, Tuple
+import time
+import argparse
+import multiprocessing
+from typing import List, Dict, Iterable, Iterator, Tuple
 from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from data_processing.entity_matcher import get_matcher
+from data_processing.chunk_io import JsonlWriter, iter_chunks
+from data_processing.chunk_store import ChunkStore
+from data_processing.dedup import deduplicate_chunks
+
+DOCUMENTS_DIR = "raw_data/documents"
+DOCUMENT_SOURCES = {
+    "zju_history.txt": "校史概述",
+    "zju_history_baidu.txt": "百度百科",
+    "zju_history_wiki.txt": "维基百科"
+}
+DEFAULT_SOURCE = "网页资料"
+OPTIMIZED_CHUNKS_PATH = "processed_data/optimized_chunks.jsonl"
+CHUNK_STORE_PATH = "processed_data/chunk_store"
+# 多遍清洗（multi_pass）的阶段，保留用于基准对比
+CLEANING_STAGES = ("remove_reference_marks", "clean_formatting", "normalize_dates",
+                   "split_long_paragraphs", "remove_redundant_info", "structure_content")
+
+# 单遍清洗使用的预编译规则
+CITATION_MARK = re.compile(r'\[\d+\]')                         # [1]
+BRACKET_NOTE = re.compile(r'\[[^\]]*?\]')                      # [需要解释]
+MAIN_ENTRY_NOTE = re.compile(r'（主词条：[^）]*?）')               # （主词条：...）
+YEAR_RANGE_DASH = re.compile(r'(\d{4})—(\d{4})')                # 1937—1945 → 1937-1945
+YEAR_RANGE = re.compile(r'(\d{4})-(\d{4})')                     # 1937-1945 → 1937至1945
+SENTENCE_SPLIT = re.compile(r'[。！？]')
+TIME_PERIOD_PATTERNS = (
+    re.compile(r'\d{4}年'),                 # 1949年
+    re.compile(r'\d{4}至\d{4}年'),          # 1937至1945年
+    re.compile(r'\d{4}-\d{4}'),             # 1897-1928
+    re.compile(r'（\d{4}至\d{4}）'),        # （1897至1928）
+)
+TITLE_MAX_LENGTH = 50
+LONG_PARAGRAPH_LENGTH = 500
+SPLIT_TARGET_LENGTH = 300
+REDUNDANT_LIST_MARKER = '理学院数学系、物理系、化学系、生物系分别并入'
+REDUNDANT_LIST_SUMMARY = "理学院各系分别调整至复旦大学、上海第一医学院、华东师范大学、南京大学等相关院校。"
+REDUNDANT_TABLE_MARKER = '浙江大学院系调整状况如下'
+
+def _split_sentences_into_paragraphs(paragraph: str) -> List[str]:
+    """按句子把超长段落重新组合成约 300 字的段落"""
+    result_paragraphs = []
+    current_chunk = []
+    current_length = 0
+    for sentence in SENTENCE_SPLIT.split(paragraph):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if current_length + len(sentence) > SPLIT_TARGET_LENGTH and current_chunk:
+            result_paragraphs.append('。'.join(current_chunk) + '。')
+            current_chunk = [sentence]
+            current_length = len(sentence)
+        else:
+            current_chunk.append(sentence)
+            current_length += len(sentence)
+    if current_chunk:
+        result_paragraphs.append('。'.join(current_chunk) + '。')
+    return result_paragraphs
+
+def _formatted_paragraphs(lines: List[str]) -> Iterator[List[str]]:
+    """去除空行与首尾空白、统一年份范围，标题行（短且无句号、不是最后一行）结束当前段落"""
+    current = []
+    pending = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if pending is not None:
+            # 确认 pending 不是最后一个非空行后，才能按标题处理
+            current.append(pending)
+            if len(pending) < TITLE_MAX_LENGTH and '。' not in pending:
+                yield current
+                current = []
+        if '—' in line:
+            line = YEAR_RANGE_DASH.sub(r'\1-\2', line)
+        if '-' in line:
+            line = YEAR_RANGE.sub(r'\1至\2', line)
+        pending = line
+    if pending is not None:
+        current.append(pending)
+    if current:
+        yield current
+
+def _paragraph_lines(paragraphs: Iterable[List[str]]) -> Iterator[str]:
+    """逐行产出段落内容，超长段落先按句子拆分，段落之间以 '' 分隔"""
+    first = True
+    for lines in paragraphs:
+        if sum(map(len, lines)) + len(lines) - 1 > LONG_PARAGRAPH_LENGTH:
+            pieces = [piece.split('\n') for piece in _split_sentences_into_paragraphs('\n'.join(lines))]
+        else:
+            pieces = [lines]
+        for piece in pieces:
+            if not first:
+                yield ''
+            first = False
+            yield from piece
+
+def _without_redundant_lines(lines: Iterable[str]) -> Iterator[str]:
+    """跳过院系调整的详细列表，'' 表示段落分隔"""
+    skip_next = False
+    for line in lines:
+        if REDUNDANT_LIST_MARKER in line:
+            yield REDUNDANT_LIST_SUMMARY
+            skip_next = True
+        elif skip_next and (line.startswith('　　') or not line):
+            continue
+        elif REDUNDANT_TABLE_MARKER in line:
+            skip_next = True
+        elif skip_next:
+            skip_next = False
+            yield line
+        else:
+            yield line
+
+def _clean_document_worker(task: Tuple[str, str, str]) -> Dict:
+    """进程池任务：清洗单个文档（每个进程各自构造清洗器）"""
+    filepath, source, relative_path = task
+    return ZJUDocumentCleaner().clean_single_document(os.path.basename(filepath), source, filepath, relative_path)
+
+def _glob_root(input_glob: str) -> str:
+    """通配符之前的目录部分，作为计算文档相对路径的根目录"""
+    root = input_glob
+    while root and glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or "."
+
 class ZJUDocumentCleaner:
-    def __init__(self):
+    def __init__(self, single_pass: bool = True):
+        # single_pass=False 时使用原有的逐阶段多遍清洗，仅用于基准对比
+        self.single_pass = single_pass
         self.cleaned_documents = []
         
-    def clean_all_documents(self):
-        """清洗所有文档"""
-        documents_info = [
-            ("zju_history.txt", "校史概述"),
-            ("zju_history_baidu.txt", "百度百科"), 
-            ("zju_history_wiki.txt", "维基百科")
-        ]
-        
-        for filename, source in documents_info:
-            print(f"🧹 正在清洗: {filename}")
-            cleaned_content = self.clean_single_document(filename, source)
-            if cleaned_content:
-                self.cleaned_documents.append(cleaned_content)
-        
-        # 保存清洗后的文档
-        self.save_cleaned_documents()
-        return self.cleaned_documents
-    
-    def clean_single_document(self, filename: str, source: str) -> Dict:
+    def clean_all_documents(self, input_glob: str = None, workers: int = 1, chunksize: int = 4) -> List[Dict]:
+        """清洗所有文档，结果全部保留在内存中；大规模语料请使用 iter_cleaned_documents"""
+        return list(self.iter_cleaned_documents(input_glob, workers, chunksize))
+    
+    def iter_cleaned_documents(self, input_glob: str = None, workers: int = 1, chunksize: int = 4) -> Iterator[Dict]:
+        """逐个产出清洗后的文档
+
+        input_glob 为空时清洗默认的三份校史文档；workers > 1 时使用进程池并行清洗。
+        每个文档完成后立即写出清洗结果，内存中只保留不含正文的清洗摘要。
+        """
+        tasks = self.collect_tasks(input_glob)
+        stage_totals = {}
+        
+        if workers > 1 and len(tasks) > 1:
+            print(f"🧹 使用 {workers} 个进程并行清洗 {len(tasks)} 个文档 (chunksize={chunksize})")
+            # 所有任务交给同一个 imap_unordered，工作进程做完一批立即领取下一批，不会在批次边界空等；
+            # 结果按完成顺序产出并立即写盘，只保留摘要
+            with multiprocessing.Pool(processes=workers) as pool:
+                for cleaned_content in pool.imap_unordered(_clean_document_worker, tasks, chunksize=chunksize):
+                    if self._collect_cleaned(cleaned_content, stage_totals):
+                        yield cleaned_content
+        else:
+            for filepath, source, relative_path in tasks:
+                print(f"🧹 正在清洗: {os.path.basename(filepath)}")
+                cleaned_content = self.clean_single_document(os.path.basename(filepath), source, filepath, relative_path)
+                if self._collect_cleaned(cleaned_content, stage_totals):
+                    yield cleaned_content
+        
+        # 保存清洗元数据
+        self.save_cleaning_metadata()
+        self.report_stage_timings(stage_totals)
+    
+    def collect_tasks(self, input_glob: str = None) -> List[Tuple[str, str, str]]:
+        """列出待清洗文档 (路径, 来源, 相对输入根目录的路径)
+
+        递归匹配时不同目录下可能有同名文件，文本块 id 由相对路径生成以免互相覆盖；
+        根目录下的文件相对路径即文件名，id 与原先一致。
+        """
+        if not input_glob:
+            return [(os.path.join(DOCUMENTS_DIR, filename), source, filename)
+                    for filename, source in DOCUMENT_SOURCES.items()]
+        root = _glob_root(input_glob)
+        tasks = []
+        for filepath in sorted(glob.glob(input_glob, recursive=True)):
+            filename = os.path.basename(filepath)
+            if filename.startswith("cleaned_") or not os.path.isfile(filepath):
+                continue
+            relative_path = os.path.relpath(filepath, root).replace(os.sep, "/")
+            tasks.append((filepath, DOCUMENT_SOURCES.get(filename, DEFAULT_SOURCE), relative_path))
+        return tasks
+    
+    def _collect_cleaned(self, cleaned_content: Dict, stage_totals: Dict[str, float]) -> bool:
+        if not cleaned_content:
+            return False
+        self.save_cleaned_document(cleaned_content)
+        for stage, seconds in cleaned_content.get("stage_timings", {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+        # 正文已写入 cleaned_ 文件，元数据中只记录摘要
+        summary = {k: v for k, v in cleaned_content.items() if k not in ("content", "paragraphs")}
+        summary["paragraph_count"] = len(cleaned_content.get("paragraphs", []))
+        self.cleaned_documents.append(summary)
+        return True
+    
+    def report_stage_timings(self, stage_totals: Dict[str, float]):
+        """输出各清洗阶段累计耗时"""
+        total = sum(stage_totals.values())
+        print(f"\n⏱️ 清洗阶段耗时（{len(self.cleaned_documents)} 个文档，累计 {total:.3f}s）:")
+        for stage, seconds in stage_totals.items():
+            share = seconds / total * 100 if total else 0.0
+            print(f"   - {stage}: {seconds:.3f}s ({share:.1f}%)")
+    
+    def clean_single_document(self, filename: str, source: str, filepath: str = None,
+                              relative_path: str = None) -> Dict:
         """清洗单个文档"""
-        filepath = f"raw_data/documents/{filename}"
+        filepath = filepath or os.path.join(DOCUMENTS_DIR, filename)
         
         try:
             with open(filepath, "r", encoding="utf-8") as f:
@@ -36,28 +223,42 @@ class ZJUDocumentCleaner:
             
             print(f"  原始长度: {len(content)} 字符")
             
-            # 分步骤清洗
-            content = self.remove_reference_marks(content)  # 移除引用标记
-            content = self.clean_formatting(content)        # 清理格式
-            content = self.normalize_dates(content)         # 标准化日期
-            content = self.split_long_paragraphs(content)   # 分割长段落
-            content = self.remove_redundant_info(content)   # 移除冗余信息
-            
-            # 结构化处理
-            structured_content = self.structure_content(content, filename)
+            original_length = len(content)
+            timings = {}
+            if self.single_pass:
+                started = time.perf_counter()
+                paragraphs = self.clean_paragraphs(content)
+                timings["clean_paragraphs"] = time.perf_counter() - started
+                started = time.perf_counter()
+                structured_content = self.structure_paragraphs(paragraphs)
+                timings["structure_content"] = time.perf_counter() - started
+            else:
+                # 分步骤清洗，记录每个阶段的耗时
+                for stage in CLEANING_STAGES[:-1]:
+                    started = time.perf_counter()
+                    content = getattr(self, stage)(content)
+                    timings[stage] = time.perf_counter() - started
+                
+                # 结构化处理
+                started = time.perf_counter()
+                structured_content = self.structure_content(content, filename)
+                timings["structure_content"] = time.perf_counter() - started
             
-            print(f"  清洗后: {len(content)} 字符")
+            print(f"  清洗后: {len(structured_content.get('content', ''))} 字符")
             
             return {
                 "filename": filename,
                 "source": source,
-                "original_length": len(content),
+                "source_path": filepath,
+                "relative_path": relative_path or filename,
+                "original_length": original_length,
                 "cleaned_length": len(structured_content.get('content', '')),
                 "content": structured_content.get('content', ''),
                 "paragraphs": structured_content.get('paragraphs', []),
                 "time_periods": structured_content.get('time_periods', []),
                 "key_figures": structured_content.get('key_figures', []),
                 "key_locations": structured_content.get('key_locations', []),
+                "stage_timings": timings,
                 "cleaned_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
             
@@ -65,6 +266,32 @@ class ZJUDocumentCleaner:
             print(f"❌ 清洗文件 {filename} 失败: {e}")
             return None
     
+    def clean_paragraphs(self, content: str) -> List[str]:
+        """单遍清洗：整篇只切分一次行，所有规则在逐行流水线中依次应用，返回清洗后的段落
+
+        与多遍清洗（remove_reference_marks → clean_formatting → normalize_dates →
+        split_long_paragraphs → remove_redundant_info）结果一致。
+        """
+        # 引用标记可能跨行，仍在整篇文本上移除；不含标记的文档直接跳过
+        if '[' in content:
+            content = BRACKET_NOTE.sub('', CITATION_MARK.sub('', content))
+        if '（主词条：' in content:
+            content = MAIN_ENTRY_NOTE.sub('', content)
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+        lines = _without_redundant_lines(_paragraph_lines(_formatted_paragraphs(content.split('\n'))))
+        paragraphs = []
+        current = []
+        for line in lines:
+            if line:
+                current.append(line)
+            elif current:
+                paragraphs.append('\n'.join(current).strip())
+                current = []
+        if current:
+            paragraphs.append('\n'.join(current).strip())
+        return paragraphs
+    
     def remove_reference_marks(self, content: str) -> str:
         """移除引用标记和注释"""
         # 移除 [数字] 格式的引用标记
@@ -167,8 +394,10 @@ class ZJUDocumentCleaner:
     def structure_content(self, content: str, filename: str) -> Dict:
         """将内容结构化"""
         # 按空行分割段落
-        raw_paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
-        
+        return self.structure_paragraphs([p.strip() for p in content.split('\n\n') if p.strip()])
+    
+    def structure_paragraphs(self, raw_paragraphs: List[str]) -> Dict:
+        """为清洗后的段落提取时间、人物、地点"""
         structured_paragraphs = []
         all_time_periods = []
         all_figures = []
@@ -182,12 +411,11 @@ class ZJUDocumentCleaner:
             time_periods = self.extract_time_periods(para)
             all_time_periods.extend(time_periods)
             
-            # 提取人物
-            figures = self.extract_figures(para)
+            # 提取人物和地点（一次扫描）
+            entities = get_matcher().extract(para)
+            figures = entities["persons"]
             all_figures.extend(figures)
-            
-            # 提取地点
-            locations = self.extract_locations(para)
+            locations = entities["locations"]
             all_locations.extend(locations)
             
             # 为段落添加结构信息
@@ -214,63 +442,39 @@ class ZJUDocumentCleaner:
     
     def extract_time_periods(self, text: str) -> List[str]:
         """提取时间信息"""
-        patterns = [
-            r'\d{4}年',                    # 1949年
-            r'\d{4}至\d{4}年',             # 1937至1945年
-            r'\d{4}-\d{4}',                # 1897-1928
-            r'（\d{4}至\d{4}）',           # （1897至1928）
-        ]
-        
         time_periods = []
-        for pattern in patterns:
-            matches = re.findall(pattern, text)
-            time_periods.extend(matches)
-        
+        for pattern in TIME_PERIOD_PATTERNS:
+            time_periods.extend(pattern.findall(text))
         return time_periods
     
     def extract_figures(self, text: str) -> List[str]:
         """提取人物"""
-        figures = [
-            "竺可桢", "林启", "蒋梦麟", "陈建功", "苏步青", "束星北", 
-            "贝时璋", "蔡邦华", "马一浮", "丰子恺", "钱穆", "王淦昌",
-            "谈家桢", "李政道", "程开甲", "谷超豪", "叶笃正", "李约瑟",
-            "邵飘萍", "何燏时", "蒋方震", "费巩", "于子三", "马寅初",
-            "刘丹", "路甬祥", "张其昀", "郑晓沧", "邵裴子", "郭任远"
-        ]
-        
-        return [f for f in figures if f in text]
+        return get_matcher().extract(text)["persons"]
     
     def extract_locations(self, text: str) -> List[str]:
         """提取地点"""
-        locations = [
-            "杭州", "建德", "吉安", "泰和", "宜山", "遵义", "湄潭",
-            "天目山", "禅源寺", "紫金港", "玉泉", "之江", "华家池",
-            "龙泉", "松木场", "湖滨", "舟山", "海宁", "宁波", "上海",
-            "南京", "北京", "贵州", "江西", "广西", "浙江"
-        ]
-        
-        return [l for l in locations if l in text]
-    
-    def save_cleaned_documents(self):
-        """保存清洗后的文档"""
-        # 保存清洗后的完整文档
-        for doc in self.cleaned_documents:
-            filename = f"cleaned_{doc['filename']}"
-            filepath = f"raw_data/documents/{filename}"
-            
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(doc['content'])
+        return get_matcher().extract(text)["locations"]
+    
+    def save_cleaned_document(self, doc: Dict):
+        """保存单个清洗后的文档（与原文件同目录，文件名加 cleaned_ 前缀）"""
+        source_path = doc.get('source_path') or os.path.join(DOCUMENTS_DIR, doc['filename'])
+        filepath = os.path.join(os.path.dirname(source_path), f"cleaned_{doc['filename']}")
         
-        # 保存清洗元数据
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.write(doc['content'])
+    
+    def save_cleaning_metadata(self):
+        """保存清洗元数据"""
         metadata = {
             "cleaned_documents": self.cleaned_documents,
             "total_documents": len(self.cleaned_documents),
-            "total_paragraphs": sum(len(doc.get('paragraphs', [])) for doc in self.cleaned_documents),
+            "total_paragraphs": sum(doc.get('paragraph_count', 0) for doc in self.cleaned_documents),
             "total_figures": len(set(f for doc in self.cleaned_documents for f in doc.get('key_figures', []))),
             "total_locations": len(set(l for doc in self.cleaned_documents for l in doc.get('key_locations', []))),
             "cleaning_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
         
+        os.makedirs("processed_data", exist_ok=True)
         with open("processed_data/cleaning_metadata.json", "w", encoding="utf-8") as f:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
         
@@ -288,16 +492,16 @@ class OptimizedChunker:
     
     def chunk_cleaned_documents(self, cleaned_documents: List[Dict]) -> List[Dict]:
         """对清洗后的文档进行智能分块"""
-        all_chunks = []
-        
-        for doc in cleaned_documents:
-            print(f"📄 处理文档: {doc['filename']}")
-            doc_chunks = self.chunk_single_document(doc)
-            all_chunks.extend(doc_chunks)
-        
+        all_chunks = list(self.iter_chunks(cleaned_documents))
         print(f"✅ 分块完成，共生成 {len(all_chunks)} 个优化文本块")
         return all_chunks
     
+    def iter_chunks(self, cleaned_documents: Iterable[Dict]) -> Iterator[Dict]:
+        """逐个文档分块并产出文本块，可直接消费 iter_cleaned_documents 的输出"""
+        for doc in cleaned_documents:
+            print(f"📄 处理文档: {doc['filename']}")
+            yield from self.chunk_single_document(doc)
+    
     def chunk_single_document(self, document: Dict) -> List[Dict]:
         """处理单个文档"""
         chunks = []
@@ -354,14 +558,15 @@ class OptimizedChunker:
     
     def create_chunk(self, document: Dict, content: str, para_index: int, sub_index: int = None) -> Dict:
         """创建优化后的数据块"""
-        chunk_id = f"{document['filename'].replace('.txt', '')}_p{para_index}"
+        chunk_id = f"{document.get('relative_path', document['filename']).replace('.txt', '')}_p{para_index}"
         if sub_index is not None:
             chunk_id += f"_s{sub_index}"
         
         # 为每个块提取独立的元数据
         time_periods = self.extract_time_periods(content)
-        figures = self.extract_figures(content)
-        locations = self.extract_locations(content)
+        entities = get_matcher().extract(content)
+        figures = entities["persons"]
+        locations = entities["locations"]
         
         return {
             "id": chunk_id,
@@ -373,7 +578,7 @@ class OptimizedChunker:
             "figures": figures,
             "locations": locations,
             "chunk_type": "optimized_chunk",
-            "quality_score": self.assess_chunk_quality(content, time_periods, figures),
+            "quality_score": self.assess_chunk_quality(content, time_periods, figures, locations),
             "chunk_timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
     
@@ -383,16 +588,13 @@ class OptimizedChunker:
     
     def extract_figures(self, content: str) -> List[str]:
         """提取人物"""
-        figures = ["竺可桢", "林启", "蒋梦麟", "陈建功", "苏步青", "束星北", 
-                  "贝时璋", "蔡邦华", "马一浮", "丰子恺", "钱穆", "王淦昌"]
-        return [f for f in figures if f in content]
+        return get_matcher().extract(content)["persons"]
     
     def extract_locations(self, content: str) -> List[str]:
         """提取地点"""
-        locations = ["杭州", "建德", "吉安", "泰和", "宜山", "遵义", "湄潭"]
-        return [l for l in locations if l in content]
+        return get_matcher().extract(content)["locations"]
     
-    def assess_chunk_quality(self, content: str, time_periods: List, figures: List) -> float:
+    def assess_chunk_quality(self, content: str, time_periods: List, figures: List, locations: List = None) -> float:
         """评估块质量"""
         score = 0.0
         
@@ -411,57 +613,90 @@ class OptimizedChunker:
             score += 0.2
         
         # 有地点信息得分
-        if self.extract_locations(content):
+        if locations is None:
+            locations = self.extract_locations(content)
+        if locations:
             score += 0.2
         
         return min(score, 1.0)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="浙大校史文档清洗与优化分块")
+    parser.add_argument("--input-glob", default=None,
+                        help="待清洗文档的 glob 模式，如 'raw_data/pages/**/*.txt'；默认清洗三份校史文档")
+    parser.add_argument("--workers", type=int, default=1, help="并行清洗的进程数，默认 1（串行）")
+    parser.add_argument("--chunksize", type=int, default=4, help="每次分发给子进程的文档数")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8,
+                        help="近重复去重的相似度阈值（字符 5-gram 的 Jaccard 估计值）")
+    parser.add_argument("--no-dedup", action="store_true", help="跳过 MinHash + LSH 近重复去重")
+    return parser.parse_args()
+
 def main():
     """主函数：执行完整的文档清洗和优化流程"""
+    args = parse_args()
     print("🚀 开始浙大校史文档深度清洗与优化...")
     
     # 1. 文档清洗
     print("\n🧹 阶段1: 文档深度清洗")
     cleaner = ZJUDocumentCleaner()
-    cleaned_docs = cleaner.clean_all_documents()
-    
-    if not cleaned_docs:
-        print("❌ 文档清洗失败")
-        return
+    cleaned_docs = cleaner.iter_cleaned_documents(args.input_glob, workers=args.workers, chunksize=args.chunksize)
     
-    # 2. 优化分块
+    # 2. 优化分块：清洗、分块与写出串成流水线，每个文档处理完即写出其文本块
     print("\n✂️ 阶段2: 优化分块")
     chunker = OptimizedChunker()
-    optimized_chunks = chunker.chunk_cleaned_documents(cleaned_docs)
+    chunk_count = 0
+    total_words = 0
+    total_quality = 0.0
+    high_quality_chunks = 0
+    
+    with JsonlWriter(OPTIMIZED_CHUNKS_PATH) as writer:
+        for chunk in chunker.iter_chunks(cleaned_docs):
+            writer.write(chunk)
+            chunk_count += 1
+            total_words += chunk['word_count']
+            total_quality += chunk.get('quality_score', 0)
+            if chunk.get('quality_score', 0) > 0.7:
+                high_quality_chunks += 1
+        if not cleaner.cleaned_documents:
+            # 没有任何文档清洗成功时保留原有的分块文件
+            writer.discard()
+    
+    if not cleaner.cleaned_documents:
+        print("❌ 文档清洗失败")
+        return
+    print(f"✅ 分块完成，共生成 {chunk_count} 个优化文本块")
     
-    # 3. 保存优化后的数据
-    print("\n💾 阶段3: 保存数据")
-    os.makedirs("processed_data", exist_ok=True)
+    # 多个来源的校史资料高度重叠：近重复块只保留质量分最高的一个，其余记录在其 duplicates 字段
+    removed_chunks = 0
+    if not args.no_dedup:
+        dedup_stats = deduplicate_chunks(OPTIMIZED_CHUNKS_PATH, threshold=args.dedup_threshold)
+        removed_chunks = dedup_stats["removed"]
+        print(f"🧬 近重复去重：{dedup_stats['clusters']} 组近重复，移除 {removed_chunks} 个文本块，"
+              f"保留 {dedup_stats['kept']} 个")
     
-    # 保存优化分块
-    with open("processed_data/optimized_chunks.json", "w", encoding="utf-8") as f:
-        json.dump(optimized_chunks, f, ensure_ascii=False, indent=2)
+    # 生成分块存储，供重建向量库与 Web 统计按 id 随机读取
+    ChunkStore.build(CHUNK_STORE_PATH, iter_chunks(OPTIMIZED_CHUNKS_PATH))
     
-    # 4. 统计信息
-    total_words = sum(chunk['word_count'] for chunk in optimized_chunks)
-    avg_chunk_size = total_words / len(optimized_chunks) if optimized_chunks else 0
-    high_quality_chunks = sum(1 for c in optimized_chunks if c.get('quality_score', 0) > 0.7)
+    # 3. 统计信息
+    avg_chunk_size = total_words / chunk_count if chunk_count else 0
+    avg_quality = total_quality / chunk_count if chunk_count else 0
     
     print(f"""
 🎉 文档清洗与优化完成！
 
 📊 优化结果统计:
-├── 清洗文档: {len(cleaned_docs)} 个
-├── 优化文本块: {len(optimized_chunks)} 个
+├── 清洗文档: {len(cleaner.cleaned_documents)} 个
+├── 优化文本块: {chunk_count} 个（去重移除 {removed_chunks} 个）
 ├── 总字数: {total_words} 字
 ├── 平均块大小: {avg_chunk_size:.1f} 字
 ├── 高质量块: {high_quality_chunks} 个 (质量分>0.7)
-└── 平均质量分: {sum(c.get('quality_score', 0) for c in optimized_chunks) / len(optimized_chunks):.2f}
+└── 平均质量分: {avg_quality:.2f}
 
 💾 生成文件:
 ├── raw_data/documents/cleaned_*.txt (清洗后的文档)
 ├── processed_data/cleaning_metadata.json (清洗元数据)
-└── processed_data/optimized_chunks.json (优化分块数据)
+├── {OPTIMIZED_CHUNKS_PATH} (优化分块数据，JSON Lines)
+└── {CHUNK_STORE_PATH}/ (分块存储：偏移索引 + 列式元数据)
 
 🎯 接下来运行: python rebuild_vector_db.py
     """)
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+import numpy as np
+
+class SemanticAnswerCache:
+    def __init__(self, path: str, similarity_threshold: float = 0.95, max_entries: int = 1000):
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, context_key TEXT NOT NULL, index_version TEXT NOT NULL, "
+                "query TEXT NOT NULL, embedding BLOB NOT NULL, answer TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_context ON answers (context_key, index_version)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_access ON answers (last_access)")
+            self._conn.commit()
+
+    @staticmethod
+    def make_context_key(chunk_ids: List[str], model: str, temperature: float) -> str:
+        payload = json.dumps([list(chunk_ids), model, temperature], ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, query_embedding, context_key: str, index_version: str) -> Optional[str]:
+        query_vec = self._normalize(query_embedding)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding, answer FROM answers WHERE context_key = ? AND index_version = ?",
+                (context_key, index_version)
+            ).fetchall()
+            best_id, best_answer, best_score = None, None, -1.0
+            if rows:
+                matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                scores = matrix @ query_vec
+                best = int(np.argmax(scores))
+                best_id, best_answer, best_score = rows[best][0], rows[best][2], float(scores[best])
+            if best_id is not None and best_score >= self.similarity_threshold:
+                self._conn.execute("UPDATE answers SET last_access = ? WHERE id = ?", (time.time(), best_id))
+                self._conn.commit()
+                self.hits += 1
+                return best_answer
+            self.misses += 1
+            return None
+
+    def store(self, query: str, query_embedding, context_key: str, index_version: str, answer: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (context_key, index_version, query, embedding, answer, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (context_key, index_version, query, self._normalize(query_embedding).tobytes(), answer, now, now)
+            )
+            # 向量库重建后旧版本的答案不再可信，连同超出容量的最久未用条目一并清除
+            self._conn.execute("DELETE FROM answers WHERE index_version != ?", (index_version,))
+            self._conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,103 @@
+import os
+import copy
+import json
+from typing import Dict
+
+DEFAULT_CONFIG = {
+    "llm": {
+        "provider": "openai",
+        "api_key": "",
+        "base_url": "https://api.openai.com/v1",
+        "model": "gpt-3.5-turbo",
+        "temperature": 0.7,
+        "max_tokens": 1000,
+        "thinking": "collapse",
+        "max_concurrency": 2,
+        "max_queue": 16,
+        "queue_timeout": 30,
+        "request_timeout": 300,
+        "pool_connections": 8,
+        "keep_alive": "30m",
+        "num_ctx": 0,
+        "num_predict": 0
+    },
+    "answer_cache": {
+        "enabled": True,
+        "path": "",
+        "similarity_threshold": 0.95,
+        "max_entries": 1000,
+        "replay_interval": 0.02
+    },
+    "rerank": {
+        "enabled": True,
+        "model": "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+        "candidates": 20,
+        "batch_size": 32,
+        "max_length": 256,
+        "time_budget": 0.5,
+        "cache_size": 4096,
+        "device": "cpu"
+    },
+    "context": {
+        "token_budget": 800,
+        "tokenizer": "",
+        "rank_weight": 0.5
+    },
+    "web": {
+        "concurrency_limit": 32,
+        "background_startup": True,
+        "warm_up": True
+    },
+    "tracing": {
+        "enabled": True,
+        "path": "logs/traces.jsonl",
+        "metrics_host": "127.0.0.1",
+        "metrics_port": 9464
+    },
+    "logging": {
+        "level": "INFO",
+        "file": "",
+        "sample_rate": 1.0,
+        "sample_rates": {}
+    },
+    "retrieval": {
+        "mode": "hybrid",
+        "chunks_path": "processed_data/optimized_chunks.jsonl",
+        "chunk_store_path": "processed_data/chunk_store",
+        "candidates": 20,
+        "rrf_k": 60,
+        "mmr_lambda": 0.7,
+        "mmr_candidates": 20
+    },
+    "sharding": {
+        "enabled": False,
+        "route_by": "source",
+        "shards": [],
+        "max_workers": 4
+    },
+    "embedding": {
+        "backend": "onnx",
+        "model": "all-MiniLM-L6-v2",
+        "batch_size": 32,
+        "num_threads": None,
+        "max_seq_length": 256,
+        "quantize": False,
+        "device": "cpu",
+        "cache_path": ""
+    }
+}
+
+def load_config(config_path: str = "config.json") -> Dict:
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if os.path.exists(config_path):
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                user_config = json.load(f)
+            for section, values in user_config.items():
+                if isinstance(values, dict) and isinstance(config.get(section), dict):
+                    config[section].update(values)
+                else:
+                    config[section] = values
+        except Exception as e:
+            print(f"[Error] Error loading config: {e}")
+    return config
@@ -1,45 +1,156 @@
+import os
+import sys
 import json
-from vector_db import SimpleVectorDB
+import hashlib
+from datetime import datetime
+from vector_db import create_vector_db
 from data_processing.metadata_extractor import MetadataExtractor
+from data_processing.entity_matcher import GAZETTEER_PATH
+from data_processing.chunk_store import open_chunk_store
 
-def rebuild_vector_database():
-    print("[INFO] 开始重建向量数据库（使用优化数据）...")
+CHUNKS_PATH = "processed_data/optimized_chunks.jsonl"
+CHUNK_STORE_PATH = "processed_data/chunk_store"
+MANIFEST_NAME = "build_manifest.json"
+# 向量库中文档结构（如元数据展开方式、实体提取方式）或清单格式变化时递增，旧清单随之失效并触发全量重建
+MANIFEST_VERSION = 4
+
+def metadata_signature():
+    # 块的内容哈希不含提取出的实体，实体词表变化后需要重建，否则已入库块保留旧的 person_* / period_* 标记
+    with open(GAZETTEER_PATH, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load_manifest(path, embedding_model, layout="collection", signature=None):
+    # 返回 None 表示集合内容无法与清单对应，需要清空集合后全量重建，
+    # 否则已从语料中删除的块无从得知，会一直留在集合里；可复用时返回整个清单
+    if not os.path.exists(path):
+        print("[INFO] 未找到构建清单，将清空集合后全量重建")
+        return None
     try:
-        with open("processed_data/optimized_chunks.json", "r", encoding="utf-8") as f:
-            optimized_chunks = json.load(f)
-    except FileNotFoundError:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            print("[WARN] 清单版本已变化，将执行全量重建")
+            return None
+        if manifest.get("embedding_model") != embedding_model:
+            print(f"[WARN] 向量模型由 {manifest.get('embedding_model')} 切换为 {embedding_model}，将执行全量重建")
+            return None
+        if manifest.get("layout", "collection") != layout:
+            print(f"[WARN] 向量库布局由 {manifest.get('layout', 'collection')} 切换为 {layout}，将执行全量重建")
+            return None
+        if signature is not None and manifest.get("metadata_signature") != signature:
+            print("[WARN] 实体词表已变化，将执行全量重建以更新元数据")
+            return None
+        return manifest
+    except Exception as e:
+        print(f"[WARN] 清单文件读取失败，将执行全量重建: {e}")
+        return None
+
+def save_manifest(path, hashes, embedding_model, layout="collection", signature=None, routes=None):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": MANIFEST_VERSION,
+            "embedding_model": embedding_model,
+            "layout": layout,
+            "metadata_signature": signature,
+            "updated_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "total_chunks": len(hashes),
+            "chunks": hashes,
+            # 分片模式下每个块所在的分片，路由键变化或块被删除时据此从原分片移除
+            "routes": routes or {}
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def build_document(chunk, metadata_extractor):
+    metadata = metadata_extractor.extract_from_content(chunk['content'])
+    if 'figures' in chunk:
+        metadata['persons'] = list(set(metadata['persons'] + chunk['figures']))
+    if 'locations' in chunk:
+        metadata['locations'] = list(set(metadata['locations'] + chunk['locations']))
+    if 'time_periods' in chunk:
+        metadata['time_periods'] = list(set(metadata['time_periods'] + chunk['time_periods']))
+    return {
+        "id": chunk['id'],
+        "content": chunk['content'],
+        "section_title": f"{chunk.get('filename', '文档')} - {chunk.get('source', '内容')}",
+        "section_level": 1,
+        "time_period": chunk.get('time_periods', [''])[0] if chunk.get('time_periods') else "",
+        "chunk_type": "optimized_chunk",
+        "metadata": metadata,
+        "source": chunk.get('source', '优化文档'),
+        "quality_score": chunk.get('quality_score', 0.5),
+        "word_count": chunk.get('word_count', 0),
+        "process_time": chunk.get('chunk_timestamp', '')
+    }
+
+def rebuild_vector_database(incremental=True, chunks_path=CHUNKS_PATH, store_path=CHUNK_STORE_PATH):
+    mode = "增量" if incremental else "全量"
+    print(f"[INFO] 开始{mode}重建向量数据库（使用优化数据）...")
+    store = open_chunk_store(store_path, chunks_path)
+    if store is None:
         print("[ERROR] 优化数据文件不存在，请先运行 document_cleaner.py")
         return
-    print(f"[INFO] 加载了 {len(optimized_chunks)} 个优化文本块")
+    print(f"[INFO] 分块存储包含 {len(store)} 个优化文本块")
+    vector_db = create_vector_db()
+    manifest_path = os.path.join(vector_db.db_path, MANIFEST_NAME)
+    signature = metadata_signature()
+    manifest = load_manifest(manifest_path, vector_db.embedding_model_id, vector_db.layout, signature)
+    if manifest is None:
+        # 向量维度或分片方式可能不同、或无法确定集合中有哪些块，旧集合无法复用；未变化文本的向量会从磁盘缓存直接取回
+        vector_db.reset_collection()
+        manifest = {}
+    old_hashes = manifest.get("chunks", {})
+    old_routes = manifest.get("routes", {})
+    if incremental and old_hashes and vector_db.count() != len(old_hashes):
+        # 清单与集合不一致（例如向量库被手动删除），清单已不可信，清空集合后全量重建，避免残留清单之外的块
+        print(f"[WARN] 清单记录 {len(old_hashes)} 条，集合实际 {vector_db.count()} 条，执行全量重建")
+        vector_db.reset_collection()
+        old_hashes, old_routes = {}, {}
+        incremental = False
     metadata_extractor = MetadataExtractor()
-    documents = []
-    for chunk in optimized_chunks:
-        metadata = metadata_extractor.extract_from_content(chunk['content'])
-        if 'figures' in chunk:
-            metadata['persons'] = list(set(metadata['persons'] + chunk['figures']))
-        if 'locations' in chunk:
-            metadata['locations'] = list(set(metadata['locations'] + chunk['locations']))
-        if 'time_periods' in chunk:
-            metadata['time_periods'] = list(set(metadata['time_periods'] + chunk['time_periods']))
-        document = {
-            "id": chunk['id'],
-            "content": chunk['content'],
-            "section_title": f"{chunk.get('filename', '文档')} - {chunk.get('source', '内容')}",
-            "section_level": 1,
-            "time_period": chunk.get('time_periods', [''])[0] if chunk.get('time_periods') else "",
-            "chunk_type": "optimized_chunk",
-            "metadata": metadata,
-            "source": chunk.get('source', '优化文档'),
-            "quality_score": chunk.get('quality_score', 0.5),
-            "word_count": chunk.get('word_count', 0),
-            "process_time": chunk.get('chunk_timestamp', '')
-        }
-        documents.append(document)
-    print(f"[INFO] 准备向量的数据库添加 {len(documents)} 个优化文档")
-    documents.sort(key=lambda x: x.get('quality_score', 0), reverse=True)
-    vector_db = SimpleVectorDB()
-    vector_db.add_documents(documents)
+    new_hashes = {}
+    new_routes = {}
+    # 路由键变化（如来源改名）的块：id -> 原分片，写入新分片后需从原分片移除，同一 id 只保留一份
+    moved_routes = {}
+    submitted_ids = []
+
+    def changed_documents():
+        # 内容哈希取自分块存储的列数据，只有新增或修改的块才需要读出正文，由 add_documents 按批向量化与写入
+        for row, chunk_id in enumerate(store.ids):
+            digest = store.hash_at(row)
+            new_hashes[chunk_id] = digest
+            if incremental and old_hashes.get(chunk_id) == digest:
+                if chunk_id in old_routes:
+                    new_routes[chunk_id] = old_routes[chunk_id]
+                continue
+            submitted_ids.append(chunk_id)
+            document = build_document(store.chunk_at(row), metadata_extractor)
+            route = vector_db.document_route(document)
+            if route is not None:
+                new_routes[chunk_id] = route
+                if old_routes.get(chunk_id) not in (None, route):
+                    moved_routes[chunk_id] = old_routes[chunk_id]
+            yield document
+
+    written_ids = set(vector_db.add_documents(changed_documents()))
+    if moved_routes:
+        # 写入失败的块同样从原分片移除，其哈希不记入清单，下次重建时按新路由写入
+        print(f"[INFO] {len(moved_routes)} 个块的分片已变化，从原分片移除")
+        vector_db.delete_documents(list(moved_routes), routes=moved_routes)
+    # 写入失败的块不记入清单，下次重建时重试
+    for chunk_id in submitted_ids:
+        if chunk_id not in written_ids:
+            new_hashes.pop(chunk_id, None)
+            new_routes.pop(chunk_id, None)
+    removed_ids = [chunk_id for chunk_id in old_hashes if chunk_id not in new_hashes]
+    unchanged = len(new_hashes) - len(written_ids)
+    print(f"[INFO] 变更统计：新增/修改 {len(written_ids)}/{len(submitted_ids)} 个，"
+          f"未变化 {unchanged} 个，删除 {len(removed_ids)} 个")
+    if removed_ids:
+        vector_db.delete_documents(removed_ids, routes=old_routes)
+    save_manifest(manifest_path, new_hashes, vector_db.embedding_model_id, vector_db.layout, signature, new_routes)
     print("[SUCCESS] 向量数据库重建完成！")
 
 if __name__ == "__main__":
-    rebuild_vector_database()
+    rebuild_vector_database(incremental="--full" not in sys.argv)
@@ -0,0 +1,143 @@
+import os
+import re
+import math
+import threading
+from typing import Dict, List, Optional
+from hybrid_search import BM25Index, tokenize
+from log_utils import get_logger
+
+logger = get_logger("context_builder")
+
+SENTENCE_END = re.compile(r'(?<=[。！？；!?;])|\n+')
+# 去重时忽略空白和标点，重叠分块中同一句话的断句差异不影响判断
+DEDUPE_STRIP = re.compile(r'[\s，,。．.！!？?；;：:、“”"‘’\'（）()《》【】\[\]—-]+')
+CJK_CHAR = re.compile(r'[㐀-鿿]')
+LATIN_RUN = re.compile(r'[A-Za-z0-9]+')
+OTHER_CHAR = re.compile(r'[^\s㐀-鿿A-Za-z0-9]')
+SENTENCE_CLOSED = re.compile(r'[。！？；!?;]$')
+DOCUMENT_HEADER = "--- Document {index} ---"
+
+def estimate_tokens(text: str) -> int:
+    # 没有分词器时的估算：汉字与标点各约 1 个 token，英文与数字约 4 个字符 1 个 token
+    latin = sum(math.ceil(len(run) / 4) for run in LATIN_RUN.findall(text))
+    return len(CJK_CHAR.findall(text)) + len(OTHER_CHAR.findall(text)) + latin
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_END.split(text) if sentence and sentence.strip()]
+
+class TokenCounter:
+    """用模型分词器（tokenizers 库的 tokenizer.json 或 Hugging Face 模型名）计数，加载失败时退回估算"""
+
+    def __init__(self, tokenizer: str = ""):
+        self.tokenizer_name = tokenizer
+        self._tokenizer = None
+        self._loaded = not tokenizer
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                from tokenizers import Tokenizer
+                if os.path.exists(self.tokenizer_name):
+                    self._tokenizer = Tokenizer.from_file(self.tokenizer_name)
+                else:
+                    self._tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+                logger.info("Context tokenizer loaded: %s", self.tokenizer_name)
+            except Exception as e:
+                logger.warning("Tokenizer %s unavailable (%s), estimating token counts", self.tokenizer_name, e)
+            self._loaded = True
+
+    def count(self, text: str) -> int:
+        if not self._loaded:
+            self._load()
+        if self._tokenizer is None:
+            return estimate_tokens(text)
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+class ContextBuilder:
+    """把检索到的文本块压缩成不超过 token 预算的参考资料
+
+    1. 按句切分，去掉重叠分块之间重复（或被更长句子包含）的句子；
+    2. 以句子为文档建立 BM25 索引，按与问题的相关度排序，检索排名靠前的块略微加权；
+    3. 按得分从高到低装入预算，最后按原块顺序、句子原顺序输出，保持上下文通顺。
+    """
+
+    def __init__(self, token_budget: int = 800, tokenizer: str = "", rank_weight: float = 0.5):
+        self.token_budget = token_budget
+        self.rank_weight = rank_weight
+        self.counter = TokenCounter(tokenizer)
+
+    @classmethod
+    def from_config(cls, context_config: Dict) -> "ContextBuilder":
+        return cls(
+            token_budget=context_config.get("token_budget", 800),
+            tokenizer=context_config.get("tokenizer", ""),
+            rank_weight=context_config.get("rank_weight", 0.5)
+        )
+
+    @staticmethod
+    def format_full(chunks: List[Dict]) -> str:
+        return "\n\n".join(
+            f"{DOCUMENT_HEADER.format(index=i + 1)}\n{chunk.get('content', '')}" for i, chunk in enumerate(chunks)
+        )
+
+    def _unique_sentences(self, chunks: List[Dict]) -> List[Dict]:
+        sentences, keys = [], []
+        for chunk_rank, chunk in enumerate(chunks):
+            for position, text in enumerate(split_sentences(chunk.get('content', ''))):
+                key = DEDUPE_STRIP.sub("", text)
+                if not key or any(key in seen for seen in keys):
+                    continue
+                # 新句子包含已收录的较短片段时，用完整句子替换片段
+                for i, seen in enumerate(keys):
+                    if seen and seen in key:
+                        keys[i] = ""
+                        sentences[i] = None
+                keys.append(key)
+                sentences.append({"text": text, "chunk_rank": chunk_rank, "position": position})
+        return [sentence for sentence in sentences if sentence is not None]
+
+    def build(self, query: str, chunks: List[Dict], stats: Optional[Dict] = None) -> str:
+        full_text = self.format_full(chunks)
+        if self.token_budget <= 0 or not chunks:
+            if stats is not None:
+                stats["context_tokens"] = self.counter.count(full_text)
+            return full_text
+
+        sentences = self._unique_sentences(chunks)
+        index = BM25Index()
+        for i, sentence in enumerate(sentences):
+            index.add(str(i), sentence["text"])
+        index.finalize()
+        relevance = {int(doc_id): score for doc_id, score in index.search(query, top_k=len(sentences))}
+        query_terms = len(set(tokenize(query))) or 1
+        for i, sentence in enumerate(sentences):
+            # BM25 分数按问题词数归一，检索排名先验保证无词面命中时仍优先保留靠前的块
+            sentence["score"] = relevance.get(i, 0.0) / query_terms + self.rank_weight / (1 + sentence["chunk_rank"])
+            sentence["tokens"] = self.counter.count(sentence["text"])
+
+        header_tokens = self.counter.count(DOCUMENT_HEADER.format(index=len(chunks))) + 2
+        used, selected, opened = 0, [], set()
+        for sentence in sorted(sentences, key=lambda s: (-s["score"], s["chunk_rank"], s["position"])):
+            cost = sentence["tokens"] + (0 if sentence["chunk_rank"] in opened else header_tokens)
+            if used + cost > self.token_budget:
+                continue
+            used += cost
+            opened.add(sentence["chunk_rank"])
+            selected.append(sentence)
+
+        blocks = []
+        for chunk_rank in sorted(opened):
+            kept = sorted((s for s in selected if s["chunk_rank"] == chunk_rank), key=lambda s: s["position"])
+            # 保留原编号，与界面中的引用来源序号对应
+            blocks.append(f"{DOCUMENT_HEADER.format(index=chunk_rank + 1)}\n" + "".join(
+                s["text"] if SENTENCE_CLOSED.search(s["text"]) else s["text"] + "\n" for s in kept
+            ).strip())
+        context = "\n\n".join(blocks)
+        if stats is not None:
+            stats["source_tokens"] = self.counter.count(full_text)
+            stats["context_tokens"] = self.counter.count(context)
+            stats["sentences"] = f"{len(selected)}/{len(sentences)}"
+        return context
@@ -0,0 +1,59 @@
+import os
+import json
+from typing import Dict, Iterable, Iterator, List
+
+def iter_chunks(path: str) -> Iterator[Dict]:
+    if os.path.isdir(path):
+        from .chunk_store import ChunkStore
+        yield from ChunkStore(path).iter_chunks()
+        return
+    # JSON Lines 逐行解析，内存占用与文件大小无关；旧版 JSON 数组文件只能整体载入
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class JsonlWriter:
+    """逐条写入 JSON Lines 文件；先写临时文件，正常结束后再替换目标文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.count = 0
+        self._file = None
+        self._discarded = False
+
+    def __enter__(self) -> "JsonlWriter":
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.tmp_path, "w", encoding="utf-8")
+        return self
+
+    def write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+        self.count += 1
+
+    def discard(self):
+        self._discarded = True
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None and not self._discarded:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
@@ -0,0 +1,218 @@
+import os
+import json
+import mmap
+import shutil
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+from .entity_matcher import ENTITY_CATEGORIES, get_matcher
+from log_utils import get_logger
+
+logger = get_logger("chunk_store")
+
+STORE_VERSION = 1
+INDEX_FILE = "index.json"
+TEXT_FILE = "texts.bin"
+META_FILE = "meta.bin"
+# 分块时间戳每次分块都会变化，不参与内容哈希
+VOLATILE_FIELDS = ("chunk_timestamp",)
+# 分块记录中直接给出的实体字段 → 实体类别
+CHUNK_ENTITY_FIELDS = {"figures": "persons", "locations": "locations", "time_periods": "time_periods"}
+
+def chunk_hash(chunk: Dict) -> str:
+    stable = {k: v for k, v in chunk.items() if k not in VOLATILE_FIELDS}
+    payload = json.dumps(stable, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ChunkStore:
+    """只读的分块存储
+
+    目录内文件：
+      texts.bin / meta.bin   正文与其余字段（UTF-8 JSON）顺序拼接，按偏移量 mmap 随机读取
+      *_offsets.npy          每行在上述文件中的起止偏移 (n + 1)
+      word_count.npy 等      列式元数据，np.load(mmap_mode="r") 按需读取
+      entities.npy           实体位图 (n, ceil(V / 8))，词表见 index.json
+      index.json             版本、行数、id 列表与实体词表
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version: {index.get('version')}")
+        self.ids: List[str] = index["ids"]
+        self.entity_vocab: List[List[str]] = index["entities"]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.text_offsets = self._load_column("text_offsets")
+        self.meta_offsets = self._load_column("meta_offsets")
+        self.word_count = self._load_column("word_count")
+        self.quality_score = self._load_column("quality_score")
+        self.hashes = self._load_column("hashes")
+        self.entity_bits = self._load_column("entities")
+        self._texts = self._map(TEXT_FILE)
+        self._meta = self._map(META_FILE)
+
+    def _load_column(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def _map(self, name: str):
+        with open(os.path.join(self.path, name), "rb") as f:
+            # 空文件无法 mmap
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._rows
+
+    def row_of(self, chunk_id: str) -> Optional[int]:
+        return self._rows.get(str(chunk_id))
+
+    def text_at(self, row: int) -> str:
+        start, end = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        return self._texts[start:end].decode("utf-8")
+
+    def meta_at(self, row: int) -> Dict:
+        start, end = int(self.meta_offsets[row]), int(self.meta_offsets[row + 1])
+        return json.loads(self._meta[start:end].decode("utf-8"))
+
+    def hash_at(self, row: int) -> str:
+        return bytes(self.hashes[row]).hex()
+
+    def chunk_at(self, row: int) -> Dict:
+        chunk = self.meta_at(row)
+        chunk["content"] = self.text_at(row)
+        return chunk
+
+    def get(self, chunk_id: str) -> Optional[Dict]:
+        row = self.row_of(chunk_id)
+        return self.chunk_at(row) if row is not None else None
+
+    def get_meta(self, chunk_id: str) -> Optional[Dict]:
+        row = self.row_of(chunk_id)
+        return self.meta_at(row) if row is not None else None
+
+    def iter_chunks(self, rows: Iterable[int] = None) -> Iterator[Dict]:
+        for row in range(len(self)) if rows is None else rows:
+            yield self.chunk_at(row)
+
+    def entities_at(self, row: int) -> Dict[str, List[str]]:
+        found = {}
+        for bit in np.flatnonzero(np.unpackbits(self.entity_bits[row], count=len(self.entity_vocab))):
+            category, name = self.entity_vocab[bit]
+            found.setdefault(category, []).append(name)
+        return found
+
+    def rows_with_entity(self, name: str) -> np.ndarray:
+        bits = [i for i, (_, entity) in enumerate(self.entity_vocab) if entity == name]
+        if not bits:
+            return np.empty(0, dtype=np.int64)
+        columns = np.unpackbits(self.entity_bits, axis=1, count=len(self.entity_vocab))[:, bits]
+        return np.flatnonzero(columns.any(axis=1))
+
+    def entity_counts(self) -> Dict[str, int]:
+        # 对所有行的位图按位或，得到语料中出现过的实体，再按类别计数
+        counts = {}
+        if not len(self):
+            return counts
+        present = np.unpackbits(np.bitwise_or.reduce(self.entity_bits, axis=0), count=len(self.entity_vocab))
+        for bit in np.flatnonzero(present):
+            category = self.entity_vocab[bit][0]
+            counts[category] = counts.get(category, 0) + 1
+        return counts
+
+    def stats(self) -> Dict:
+        total_chars = int(self.word_count.sum()) if len(self) else 0
+        return {
+            "total_chunks": len(self),
+            "total_chars": total_chars,
+            "avg_chunk_size": total_chars / len(self) if len(self) else 0.0,
+            "avg_quality": float(self.quality_score.mean()) if len(self) else 0.0,
+            "entities": self.entity_counts()
+        }
+
+    @classmethod
+    def build(cls, path: str, chunks: Iterable[Dict]) -> "ChunkStore":
+        """从分块流写出存储：正文与元数据边读边写，列数据在最后一次性落盘"""
+        tmp_path = path.rstrip("/\\") + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        matcher = get_matcher()
+        ids, word_counts, quality_scores, hashes, entity_rows = [], [], [], [], []
+        text_offsets, meta_offsets = [0], [0]
+        vocab, vocab_index = [], {}
+        with open(os.path.join(tmp_path, TEXT_FILE), "wb") as text_file, \
+                open(os.path.join(tmp_path, META_FILE), "wb") as meta_file:
+            for chunk in chunks:
+                content = chunk.get("content", "")
+                meta = {k: v for k, v in chunk.items() if k != "content"}
+                text_bytes = content.encode("utf-8")
+                meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+                text_file.write(text_bytes)
+                meta_file.write(meta_bytes)
+                text_offsets.append(text_offsets[-1] + len(text_bytes))
+                meta_offsets.append(meta_offsets[-1] + len(meta_bytes))
+                ids.append(str(chunk["id"]))
+                word_counts.append(chunk.get("word_count", len(content)))
+                quality_scores.append(chunk.get("quality_score", 0.0))
+                hashes.append(bytes.fromhex(chunk_hash(chunk)))
+
+                entities = {category: set(names) for category, names in matcher.extract(content).items()
+                            if category in ENTITY_CATEGORIES}
+                for field, category in CHUNK_ENTITY_FIELDS.items():
+                    entities.setdefault(category, set()).update(chunk.get(field, []))
+                row_bits = []
+                for category, names in entities.items():
+                    for name in names:
+                        key = (category, name)
+                        if key not in vocab_index:
+                            vocab_index[key] = len(vocab)
+                            vocab.append([category, name])
+                        row_bits.append(vocab_index[key])
+                entity_rows.append(row_bits)
+
+        # 直接按 np.packbits 的位序（高位在前）置位，避免生成 n × V 的稠密矩阵
+        entity_bits = np.zeros((len(ids), (len(vocab) + 7) // 8), dtype=np.uint8)
+        for row, row_bits in enumerate(entity_rows):
+            for bit in row_bits:
+                entity_bits[row, bit >> 3] |= 0x80 >> (bit & 7)
+        columns = {
+            "text_offsets": np.asarray(text_offsets, dtype=np.int64),
+            "meta_offsets": np.asarray(meta_offsets, dtype=np.int64),
+            "word_count": np.asarray(word_counts, dtype=np.int32),
+            "quality_score": np.asarray(quality_scores, dtype=np.float32),
+            "hashes": np.frombuffer(b"".join(hashes), dtype=np.uint8).reshape(len(ids), 32),
+            "entities": entity_bits
+        }
+        for name, column in columns.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), column)
+        with open(os.path.join(tmp_path, INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump({"version": STORE_VERSION, "count": len(ids), "ids": ids, "entities": vocab},
+                      f, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+def open_chunk_store(store_path: str, chunks_path: str = None) -> Optional[ChunkStore]:
+    """打开分块存储；存储缺失或比分块文件旧时从分块文件重新生成"""
+    from .chunk_io import iter_chunks
+    index_path = os.path.join(store_path, INDEX_FILE)
+    stale = not os.path.exists(index_path)
+    if not stale and chunks_path and os.path.exists(chunks_path):
+        stale = os.path.getmtime(chunks_path) > os.path.getmtime(index_path)
+    if stale:
+        if not chunks_path or not os.path.exists(chunks_path):
+            return None
+        logger.info("Building chunk store %s from %s", store_path, chunks_path)
+        return ChunkStore.build(store_path, iter_chunks(chunks_path))
+    try:
+        return ChunkStore(store_path)
+    except (ValueError, OSError, KeyError) as e:
+        logger.warning("Chunk store unreadable, rebuilding: %s", e)
+        if chunks_path and os.path.exists(chunks_path):
+            return ChunkStore.build(store_path, iter_chunks(chunks_path))
+        return None
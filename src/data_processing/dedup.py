@@ -0,0 +1,136 @@
+import re
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .chunk_io import JsonlWriter, iter_chunks
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+ROLLING_BASE = np.uint64(1000003)
+# 比较时忽略空白与标点，只看文字本身
+NON_WORD = re.compile(r'[\W_]+')
+
+class MinHasher:
+    """字符 k-gram 的 MinHash 签名，numpy 向量化计算"""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def shingle_hashes(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(NON_WORD.sub("", text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        if not len(codes):
+            return codes
+        k = min(self.shingle_size, len(codes))
+        windows = len(codes) - k + 1
+        # 多项式滚动哈希，按列累加所有窗口，uint64 溢出即取模 2^64
+        hashes = np.zeros(windows, dtype=np.uint64)
+        for offset in range(k):
+            hashes = hashes * ROLLING_BASE + codes[offset:offset + windows]
+        return np.unique(hashes & MAX_HASH)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingle_hashes(text)
+        if not len(hashes):
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint32)
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1).astype(np.uint32)
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """选择 LSH 的分带数与每带行数，使 S 曲线阈值 (1/b)^(1/r) 不高于且最接近目标相似度"""
+    best = (num_perm, 1)
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        curve = (1 / bands) ** (1 / rows)
+        if curve <= threshold and curve > (1 / best[0]) ** (1 / best[1]):
+            best = (bands, rows)
+    return best
+
+def _find(parent: np.ndarray, i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def cluster_signatures(signatures: np.ndarray, threshold: float = 0.8, bands: int = None) -> np.ndarray:
+    """LSH 分桶后只比较同桶签名，返回每行所属簇的根行号
+
+    每个桶内只与桶中第一行比较，整体开销随文本块数近似线性增长。
+    """
+    count, num_perm = signatures.shape
+    if bands is None:
+        bands, rows = choose_bands(num_perm, threshold)
+    else:
+        rows = num_perm // bands
+    parent = np.arange(count)
+    for band in range(bands):
+        columns = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = columns[:, 0].copy()
+        for column in range(1, rows):
+            keys = keys * ROLLING_BASE + columns[:, column]
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], count]
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = order[start:end]
+            head = members[0]
+            similarity = (signatures[members[1:]] == signatures[head]).mean(axis=1)
+            for member in members[1:][similarity >= threshold]:
+                root_a, root_b = _find(parent, head), _find(parent, member)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([_find(parent, i) for i in range(count)])
+
+def deduplicate_chunks(chunks_path: str, output_path: Optional[str] = None, threshold: float = 0.8,
+                       num_perm: int = 128, shingle_size: int = 5) -> Dict:
+    """对分块文件做近重复去重
+
+    第一遍只计算 MinHash 签名并记录 id 与质量分；聚类后第二遍流式写出每个簇中 quality_score
+    最高的文本块，被合并的块记录在保留块的 duplicates 字段中（id、来源、文件名与估计相似度）。
+    output_path 为空时原地替换分块文件。
+    """
+    hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+    signatures, qualities, provenance = [], [], []
+    for chunk in iter_chunks(chunks_path):
+        signatures.append(hasher.signature(chunk.get("content", "")))
+        qualities.append(chunk.get("quality_score", 0.0))
+        provenance.append({"id": str(chunk["id"]), "source": chunk.get("source", ""),
+                           "filename": chunk.get("filename", "")})
+    if not signatures:
+        return {"total": 0, "kept": 0, "removed": 0, "clusters": 0}
+
+    signatures = np.vstack(signatures)
+    roots = cluster_signatures(signatures, threshold)
+    keep = {}
+    for row, root in enumerate(roots):
+        # 质量分相同时保留排在前面的块
+        if root not in keep or qualities[row] > qualities[keep[root]]:
+            keep[root] = row
+    duplicates: Dict[int, List[Dict]] = {}
+    for row, root in enumerate(roots):
+        kept = keep[root]
+        if row != kept:
+            similarity = float((signatures[row] == signatures[kept]).mean())
+            duplicates.setdefault(kept, []).append({**provenance[row], "similarity": round(similarity, 3)})
+
+    kept_rows = set(keep.values())
+    with JsonlWriter(output_path or chunks_path) as writer:
+        for row, chunk in enumerate(iter_chunks(chunks_path)):
+            if row not in kept_rows:
+                continue
+            if row in duplicates:
+                chunk["duplicates"] = duplicates[row]
+            writer.write(chunk)
+    return {
+        "total": len(roots),
+        "kept": len(kept_rows),
+        "removed": len(roots) - len(kept_rows),
+        "clusters": sum(1 for row in kept_rows if row in duplicates)
+    }
@@ -0,0 +1,108 @@
+import os
+import json
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.json")
+ENTITY_CATEGORIES = ("persons", "locations", "institutions", "periods")
+EVENT_CATEGORY = "event_keywords"
+
+class EntityMatch(NamedTuple):
+    start: int
+    end: int
+    name: str
+    category: str
+
+class AhoCorasickAutomaton:
+    def __init__(self, patterns: Dict[str, str]):
+        # 节点以下标表示：goto 为转移表，fail 为失败指针，outputs 为以该节点结尾的 (模式, 类别)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[List[Tuple[str, str]]] = [[]]
+        for pattern, category in patterns.items():
+            self._insert(pattern, category)
+        self._build_failure_links()
+
+    def _insert(self, pattern: str, category: str):
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            node = next_node
+        self.outputs[node].append((pattern, category))
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                # 合并失败链上的输出，匹配时无需再沿失败指针回溯
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[EntityMatch]:
+        node = 0
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern, category in outputs[node]:
+                yield EntityMatch(index + 1 - len(pattern), index + 1, pattern, category)
+
+class EntityMatcher:
+    def __init__(self, gazetteer: Dict):
+        self.gazetteer = gazetteer
+        patterns = {}
+        for category in ENTITY_CATEGORIES + (EVENT_CATEGORY,):
+            for name in gazetteer.get(category, []):
+                patterns.setdefault(name, category)
+        self.automaton = AhoCorasickAutomaton(patterns)
+
+    def names(self, category: str) -> List[str]:
+        return list(self.gazetteer.get(category, []))
+
+    def find(self, text: str) -> List[EntityMatch]:
+        # 实体类别取最左最长且互不重叠的匹配（“浙江大学”不再额外计为地点“浙江”）；事件关键词保留全部匹配
+        entities, events = [], []
+        for match in self.automaton.iter_matches(text):
+            (events if match.category == EVENT_CATEGORY else entities).append(match)
+        entities.sort(key=lambda m: (m.start, m.start - m.end))
+        selected = []
+        last_end = 0
+        for match in entities:
+            if match.start >= last_end:
+                selected.append(match)
+                last_end = match.end
+        return sorted(selected + events, key=lambda m: (m.start, m.end))
+
+    def extract(self, text: str) -> Dict[str, List[str]]:
+        found = {category: [] for category in ENTITY_CATEGORIES + (EVENT_CATEGORY,)}
+        for match in self.find(text):
+            if match.name not in found[match.category]:
+                found[match.category].append(match.name)
+        return found
+
+def load_gazetteer(path: Optional[str] = None) -> Dict:
+    with open(path or GAZETTEER_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def get_matcher() -> EntityMatcher:
+    global _matcher
+    with _matcher_lock:
+        if _matcher is None:
+            _matcher = EntityMatcher(load_gazetteer())
+        return _matcher
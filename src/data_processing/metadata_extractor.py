@@ -1,32 +1,29 @@
 import re
+from bisect import bisect_right
 from typing import Dict
+from .entity_matcher import get_matcher
+
+SENTENCE_PATTERN = re.compile(r'[^。！？]+')
+YEAR_PATTERN = re.compile(r'\d{4}年')
 
 class MetadataExtractor:
     def __init__(self):
+        self.matcher = get_matcher()
         self.time_periods = self.load_time_periods()
         self.important_figures = self.load_important_figures()
         self.locations = self.load_locations()
     
     def load_time_periods(self):
         return {
-            "溯源求是": ("1897", "1928"),
-            "探求崛起": ("1928", "1952"), 
-            "调整发展": ("1952", "1998"),
-            "争创一流": ("1998", "2024")
+            name: (str(start), str(end))
+            for name, (start, end) in self.matcher.gazetteer.get("periods", {}).items()
         }
     
     def load_important_figures(self):
-        return [
-            "林启", "竺可桢", "蒋梦麟", "陈建功", "苏步青", "束星北", 
-            "贝时璋", "蔡邦华", "马一浮", "丰子恺", "钱穆", "王淦昌",
-            "谈家桢", "李政道", "程开甲", "谷超豪", "叶笃正"
-        ]
+        return self.matcher.names("persons")
     
     def load_locations(self):
-        return [
-            "杭州", "建德", "吉安", "泰和", "宜山", "遵义", "湄潭",
-            "天目山", "禅源寺", "紫金港", "玉泉", "之江", "华家池"
-        ]
+        return self.matcher.names("locations")
     
     def extract_from_content(self, content: str) -> Dict:
         metadata = {
@@ -37,29 +34,31 @@ class MetadataExtractor:
             "institutions": []
         }
         
-        for period, (start, end) in self.time_periods.items():
-            if period in content:
-                metadata["time_periods"].append(period)
-        
-        years = re.findall(r'\d{4}年', content)
-        metadata["time_periods"].extend(years)
+        # 一次扫描取得全部实体及其位置
+        matches = self.matcher.find(content)
         
-        for person in self.important_figures:
-            if person in content:
-                metadata["persons"].append(person)
+        for match in matches:
+            if match.category == "periods":
+                metadata["time_periods"].append(match.name)
+            elif match.category == "persons":
+                metadata["persons"].append(match.name)
+            elif match.category == "locations":
+                metadata["locations"].append(match.name)
+            elif match.category == "institutions":
+                metadata["institutions"].append(match.name)
         
-        for location in self.locations:
-            if location in content:
-                metadata["locations"].append(location)
-        
-        event_keywords = ["创立", "成立", "迁往", "调整", "合并", "西迁", "办学"]
-        sentences = re.split(r'[。！？]', content)
-        for sentence in sentences:
-            if any(keyword in sentence for keyword in event_keywords):
-                metadata["events"].append(sentence.strip())
+        years = YEAR_PATTERN.findall(content)
+        metadata["time_periods"].extend(years)
         
-        institutions = re.findall(r'[《]?(浙江大学|求是书院|杭州大学|浙江农业大学|浙江医科大学)[》]?', content)
-        metadata["institutions"].extend(institutions)
+        # 事件：包含事件关键词的句子，按关键词位置定位所在句子
+        event_starts = [match.start for match in matches if match.category == "event_keywords"]
+        if event_starts:
+            sentences = list(SENTENCE_PATTERN.finditer(content))
+            sentence_starts = [sentence.start() for sentence in sentences]
+            for position in event_starts:
+                index = bisect_right(sentence_starts, position) - 1
+                if index >= 0 and position < sentences[index].end():
+                    metadata["events"].append(sentences[index].group().strip())
         
         for key in metadata:
             metadata[key] = list(set(metadata[key]))
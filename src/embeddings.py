@@ -0,0 +1,197 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from functools import cached_property
+from typing import Dict, List, Optional
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingDiskCache:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model_id TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model_id, content_hash))"
+            )
+            self._conn.commit()
+
+    def get_many(self, model_id: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite 单条语句的参数个数有限，分段查询
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model_id = ? AND content_hash IN ({placeholders})",
+                    [model_id] + part
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model_id: str, items: Dict[str, np.ndarray]):
+        if not items:
+            return
+        rows = [(model_id, digest, np.asarray(vector, dtype=np.float32).tobytes()) for digest, vector in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_id, content_hash, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+class SentenceTransformerBackend:
+    def __init__(self, model_name: str, batch_size: int = 32, num_threads: Optional[int] = None,
+                 max_seq_length: Optional[int] = 256, quantize: bool = False, device: str = "cpu"):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device=device)
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        if quantize:
+            # 动态 int8 量化只作用于线性层，CPU 推理提速明显且精度损失很小
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        precision = "int8" if quantize else "fp32"
+        self.model_id = f"sentence-transformers:{model_name}:{self.model.max_seq_length}:{precision}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).astype(np.float32)
+
+class _TunedONNXMiniLM(ONNXMiniLM_L6_V2):
+    def __init__(self, batch_size: int = 32, num_threads: Optional[int] = None,
+                 max_seq_length: int = 256, quantize: bool = False):
+        super().__init__(preferred_providers=["CPUExecutionProvider"])
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.max_seq_length = max_seq_length
+        self.quantize = quantize
+
+    @cached_property
+    def tokenizer(self):
+        tokenizer = ONNXMiniLM_L6_V2.tokenizer.func(self)
+        tokenizer.enable_truncation(max_length=self.max_seq_length)
+        tokenizer.enable_padding(pad_id=0, pad_token="[PAD]", length=self.max_seq_length)
+        return tokenizer
+
+    @cached_property
+    def model(self):
+        model_path = os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx")
+        if self.quantize:
+            quantized_path = os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.int8.onnx")
+            if not os.path.exists(quantized_path):
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+            model_path = quantized_path
+        so = self.ort.SessionOptions()
+        so.log_severity_level = 3
+        so.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            so.intra_op_num_threads = self.num_threads
+        return self.ort.InferenceSession(model_path, providers=self._preferred_providers, sess_options=so)
+
+    def _forward(self, documents: List[str], batch_size: int = 32):
+        return super()._forward(documents, batch_size=self.batch_size)
+
+class OnnxMiniLMBackend:
+    def __init__(self, batch_size: int = 32, num_threads: Optional[int] = None,
+                 max_seq_length: Optional[int] = 256, quantize: bool = False):
+        max_seq_length = max_seq_length or 256
+        self.model = _TunedONNXMiniLM(batch_size, num_threads, max_seq_length, quantize)
+        precision = "int8" if quantize else "fp32"
+        self.model_id = f"onnx:all-MiniLM-L6-v2:{max_seq_length}:{precision}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model(texts), dtype=np.float32)
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    def __init__(self, backend, cache: Optional[EmbeddingDiskCache] = None):
+        self.backend = backend
+        self.cache = cache
+        self.model_id = backend.model_id
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        hashes = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model_id, hashes) if self.cache else {}
+        missing = {}
+        for text, digest in zip(texts, hashes):
+            if digest not in vectors:
+                missing.setdefault(digest, text)
+        if missing:
+            computed = dict(zip(missing, self.backend.embed(list(missing.values()))))
+            if self.cache:
+                self.cache.put_many(self.model_id, computed)
+            vectors.update(computed)
+        return [np.asarray(vectors[digest], dtype=np.float32) for digest in hashes]
+
+    def embed_queries(self, texts: List[str]) -> Embeddings:
+        # 用户问题不写入磁盘缓存：任意文本会让缓存无限增长，且每次同步提交会拖慢检索；
+        # 查询向量由 SimpleVectorDB 的内存 LRU 缓存
+        return [np.asarray(vector, dtype=np.float32) for vector in self.backend.embed(list(texts))]
+
+    @staticmethod
+    def name() -> str:
+        return "zju_cached_embedding"
+
+    def get_config(self) -> Dict:
+        return {"model_id": self.model_id}
+
+    @staticmethod
+    def build_from_config(config: Dict) -> "CachedEmbeddingFunction":
+        # Chroma 按集合里保存的配置重建向量函数，必须还原出同一个模型，否则查询向量与库内向量不可比
+        return create_embedding_function(embedding_config_from_model_id(config.get("model_id", "")))
+
+def embedding_config_from_model_id(model_id: str) -> Dict:
+    """把 model_id（后端:模型:最大长度:精度）还原为 create_embedding_function 的配置"""
+    backend, _, rest = model_id.partition(":")
+    parts = rest.rsplit(":", 2)
+    if backend not in ("onnx", "sentence-transformers") or len(parts) != 3 or not parts[1].isdigit() \
+            or parts[2] not in ("fp32", "int8") or (backend == "onnx" and parts[0] != "all-MiniLM-L6-v2"):
+        raise ValueError(f"Cannot rebuild embedding function from model_id '{model_id}'")
+    return {
+        "backend": backend,
+        "model": parts[0],
+        "max_seq_length": int(parts[1]),
+        "quantize": parts[2] == "int8"
+    }
+
+def create_embedding_function(embedding_config: Dict, cache_path: Optional[str] = None) -> CachedEmbeddingFunction:
+    backend_name = embedding_config.get("backend", "onnx")
+    options = {
+        "batch_size": embedding_config.get("batch_size", 32),
+        "num_threads": embedding_config.get("num_threads"),
+        "max_seq_length": embedding_config.get("max_seq_length", 256),
+        "quantize": embedding_config.get("quantize", False)
+    }
+    if backend_name == "sentence-transformers":
+        backend = SentenceTransformerBackend(
+            embedding_config.get("model", "paraphrase-multilingual-MiniLM-L12-v2"),
+            device=embedding_config.get("device", "cpu"),
+            **options
+        )
+    else:
+        backend = OnnxMiniLMBackend(**options)
+    cache_path = embedding_config.get("cache_path") or cache_path
+    cache = EmbeddingDiskCache(cache_path) if cache_path else None
+    return CachedEmbeddingFunction(backend, cache)
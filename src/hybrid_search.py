@@ -0,0 +1,128 @@
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+import jieba
+import numpy as np
+from data_processing.semantic_chunker import ZJUHistoryChunker
+from data_processing.entity_matcher import ENTITY_CATEGORIES, get_matcher
+from data_processing.chunk_io import iter_chunks
+from log_utils import get_logger
+
+STOPWORDS = {
+    "的", "了", "是", "在", "和", "与", "及", "也", "有", "为", "于", "对", "被", "把",
+    "什么", "哪些", "怎样", "怎么", "如何", "是否", "一个", "这个", "那个", "这些", "那些"
+}
+logger = get_logger("hybrid_search")
+TOKEN_PATTERN = re.compile(r'[一-龥A-Za-z0-9]')
+
+_vocab_lock = threading.Lock()
+_vocab_loaded = False
+
+def _ensure_vocabulary():
+    global _vocab_loaded
+    with _vocab_lock:
+        if _vocab_loaded:
+            return
+        # ZJUHistoryChunker 在构造时把校史术语注册进 jieba，这里再补充实体词表中的名称
+        ZJUHistoryChunker()
+        gazetteer = get_matcher().gazetteer
+        for category in ENTITY_CATEGORIES:
+            for word in gazetteer.get(category, []):
+                jieba.add_word(word)
+        _vocab_loaded = True
+
+def tokenize(text: str) -> List[str]:
+    _ensure_vocabulary()
+    tokens = []
+    for token in jieba.lcut_for_search(text):
+        token = token.strip().lower()
+        if token and token not in STOPWORDS and TOKEN_PATTERN.search(token):
+            tokens.append(token)
+    return tokens
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self.doc_lengths = []
+        self.postings = defaultdict(list)
+        self.idf = {}
+        self.avg_length = 0.0
+
+    @classmethod
+    def from_chunks_file(cls, path: str, **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        for chunk in iter_chunks(path):
+            index.add(str(chunk['id']), chunk.get('content', ''))
+        index.finalize()
+        logger.info("BM25 index built: %d documents, %d terms", len(index.doc_ids), len(index.postings))
+        return index
+
+    def add(self, doc_id: str, text: str):
+        doc_index = len(self.doc_ids)
+        term_freqs = Counter(tokenize(text))
+        self.doc_ids.append(doc_id)
+        self.doc_lengths.append(sum(term_freqs.values()))
+        for term, freq in term_freqs.items():
+            self.postings[term].append((doc_index, freq))
+
+    def finalize(self):
+        total = len(self.doc_ids)
+        self.avg_length = sum(self.doc_lengths) / total if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_index, freq in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / (self.avg_length or 1))
+                scores[doc_index] += idf * freq * (self.k1 + 1) / (freq + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.doc_ids[doc_index], score) for doc_index, score in ranked]
+
+def maximal_marginal_relevance(query_embedding, embeddings, relevance, k: int, lambda_mult: float = 0.7) -> List[int]:
+    """MMR 贪心选择：每步选 λ·相关度 − (1−λ)·与已选结果的最大余弦相似度 最高的候选，返回候选下标
+
+    relevance 为检索阶段给出的相关度（混合检索为融合分、重排序后为交叉编码器分），先缩放到 [0, 1]；
+    候选向量两两相似度一次矩阵乘法算出，之后每步只做向量化的 max 更新。
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    count = len(vectors)
+    if count == 0 or k <= 0:
+        return []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if relevance is None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    relevance = np.asarray(relevance, dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(count, dtype=np.float32)
+    pairwise = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[:, selected[0]].copy()
+    available = np.ones(count, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(k, count) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        available[chosen] = False
+        np.maximum(redundancy, pairwise[:, chosen], out=redundancy)
+    return selected
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,43 +1,116 @@
 import os
 import json
-from typing import List, Dict
+import time
+import asyncio
+from typing import AsyncIterator, List, Dict, Tuple
+from app_config import load_config
+from tracing import tracer
+from log_utils import get_logger, setup_logging
+from context_builder import ContextBuilder
 try:
-    from openai import OpenAI
+    import httpx
+    from openai import OpenAI, AsyncOpenAI
 except ImportError:
     OpenAI = None
+    AsyncOpenAI = None
+
+logger = get_logger("llm_client")
+
+# 固定的系统提示词放在消息最前面，且每次请求逐字节相同，推理引擎可以复用这段前缀的 KV 缓存；
+# 随问题变化的参考资料和问题都放在其后的用户消息中
+SYSTEM_PROMPT = """你是一个浙江大学校史专家助手。请基于提供的上下文信息回答用户的问题。
+
+要求：
+1. 仅依据提供的上下文回答，不要编造信息。
+2. 如果上下文中没有相关信息，请明确说明"根据现有资料无法回答"。
+3. 回答要条理清晰，语言流畅，准确引用历史事实（如时间、人物、地点）。
+4. 如果有多个相关事件，请按时间顺序组织回答。
+5. 语气要专业、客观、敬业。"""
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+def split_thinking(text: str) -> Tuple[str, str, bool]:
+    # deepseek-r1 先输出 <think>...</think> 推理过程，再输出正式回答；部分版本省略开头标签
+    stripped = text.lstrip()
+    if stripped.startswith(THINK_OPEN):
+        body = stripped[len(THINK_OPEN):]
+        if THINK_CLOSE not in body:
+            return body.strip(), "", False
+        thinking, answer = body.split(THINK_CLOSE, 1)
+        return thinking.strip(), answer.lstrip(), True
+    if THINK_CLOSE in text:
+        thinking, answer = text.split(THINK_CLOSE, 1)
+        return thinking.strip(), answer.lstrip(), True
+    if THINK_OPEN.startswith(stripped) and stripped:
+        # 流式输出刚开始，标签尚未完整到达
+        return "", "", False
+    return "", text, True
+
+class GenerationTimer:
+    """记录一次流式生成的首 token 延迟、token 数与生成速度"""
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.tokens = 0
+
+    def token(self):
+        # 流式响应中每个非空增量约对应一个 token
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            tracer.record("llm_ttft", self.first_token_at - self.started, trace=self.trace, started=self.started)
+        self.tokens += 1
+
+    def finish(self):
+        duration = time.perf_counter() - self.started
+        decode_time = time.perf_counter() - self.first_token_at if self.first_token_at else 0.0
+        rate = tracer.record_generation(self.tokens, decode_time, trace=self.trace)
+        tracer.record("llm_generate", duration, trace=self.trace, started=self.started,
+                      tokens=self.tokens, tokens_per_second=round(rate, 2))
+
+class GenerationStatus:
+    """记录一次生成的结束方式，调用方据此判断回答是否完整"""
+
+    COMPLETED = "completed"
+    TIMEOUT = "timeout"
+    BUSY = "busy"
+    ERROR = "error"
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value, trace=None):
+        self.value = value
+        if trace is not None:
+            trace.attributes["generation_status"] = value
+
+    @property
+    def completed(self) -> bool:
+        return self.value == self.COMPLETED
 
 class LLMGenerator:
     def __init__(self, config_path: str = "config.json"):
         self.config_path = config_path
         self.config = self._load_config()
+        setup_logging(self.config.get("logging"))
+        self.context_builder = ContextBuilder.from_config(self.config.get("context", {}))
         self.client = None
+        self.async_client = None
+        self._http_client = None
+        self._client_kwargs = None
+        self._waiting = 0
+        self.in_flight = 0
+        self._semaphore = asyncio.Semaphore(self.config.get("llm", {}).get("max_concurrency", 2))
         self._setup_client()
 
     def _load_config(self) -> Dict:
-        default_config = {
-            "llm": {
-                "provider": "openai",
-                "api_key": "",
-                "base_url": "https://api.openai.com/v1",
-                "model": "gpt-3.5-turbo",
-                "temperature": 0.7,
-                "max_tokens": 1000
-            }
-        }
-        if os.path.exists(self.config_path):
-            try:
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    user_config = json.load(f)
-                    if "llm" in user_config:
-                        default_config["llm"].update(user_config["llm"])
-                    return default_config
-            except Exception as e:
-                print(f"[Error] Error loading config: {e}")
-        return default_config
+        return load_config(self.config_path)
 
     def _setup_client(self):
         if OpenAI is None:
-            print("[Error] OpenAI library not installed. Please install it: pip install openai")
+            logger.error("OpenAI library not installed. Please install it: pip install openai")
             return
         llm_config = self.config.get("llm", {})
         api_key = llm_config.get("api_key")
@@ -50,78 +123,243 @@ class LLMGenerator:
         if provider == "ollama" and not api_key:
             api_key = "ollama"
         if not api_key or api_key == "YOUR_API_KEY_HERE":
-            print("[WARN] No valid API key found. LLM features will be disabled until configured.")
+            logger.warning("No valid API key found. LLM features will be disabled until configured.")
             return
         try:
-            self.client = OpenAI(api_key=api_key, base_url=base_url)
-            print(f"[INFO] LLM Client initialized (Model: {llm_config.get('model')})")
+            self._client_kwargs = {"api_key": api_key, "base_url": base_url}
+            self.client = OpenAI(**self._client_kwargs)
+            logger.info("LLM Client initialized (Model: %s)", llm_config.get('model'))
         except Exception as e:
-            print(f"[ERROR] Failed to initialize LLM Client: {e}")
-
-    def generate_answer(self, query: str, context_chunks: List[Dict], stream: bool = False):
-        context_text = "\n\n".join([
-            f"--- Document {i+1} ---\n{chunk.get('content', '')}" 
-            for i, chunk in enumerate(context_chunks)
-        ])
-        system_prompt = """你是一个浙江大学校史专家助手。请基于提供的上下文信息回答用户的问题。
-        
-        要求：
-        1. 仅依据提供的上下文回答，不要编造信息。
-        2. 如果上下文中没有相关信息，请明确说明"根据现有资料无法回答"。
-        3. 回答要条理清晰，语言流畅，准确引用历史事实（如时间、人物、地点）。
-        4. 如果有多个相关事件，请按时间顺序组织回答。
-        5. 语气要专业、客观、敬业。
-        """
-        user_prompt = f"""
-        问题：{query}
-
-        参考资料：
-        {context_text}
-
-        请根据参考资料回答上述问题：
-        """
+            logger.error("Failed to initialize LLM Client: %s", e)
+
+    def _build_messages(self, query: str, context_chunks: List[Dict], stats: Dict = None) -> List[Dict]:
+        context_text = self.context_builder.build(query, context_chunks, stats=stats)
+        user_prompt = f"参考资料：\n{context_text}\n\n问题：{query}\n\n请根据参考资料回答上述问题："
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def is_ollama(self) -> bool:
+        return self.config.get("llm", {}).get("provider", "openai") == "ollama"
+
+    def completion_params(self) -> Dict:
+        llm_config = self.config.get("llm", {})
+        return {
+            "model": llm_config.get("model", "gpt-3.5-turbo"),
+            "temperature": llm_config.get("temperature", 0.7),
+            "max_tokens": llm_config.get("max_tokens", 1000)
+        }
+
+    def ollama_url(self, path: str) -> str:
+        native_url = self._client_kwargs["base_url"].rstrip("/")
+        if native_url.endswith("/v1"):
+            native_url = native_url[:-3]
+        return f"{native_url}{path}"
+
+    def ollama_payload(self, messages: List[Dict], stream: bool, num_predict: int = None) -> Dict:
+        # Ollama 的 OpenAI 兼容接口 /v1 会忽略 keep_alive 与 options，因此生成与预加载都走原生 /api/chat，
+        # 且由同一函数构造参数：num_ctx 不一致会让 Ollama 重新加载模型
         llm_config = self.config.get("llm", {})
-        model = llm_config.get("model", "gpt-3.5-turbo")
-        temperature = llm_config.get("temperature", 0.7)
-        max_tokens = llm_config.get("max_tokens", 1000)
+        params = self.completion_params()
+        options = {"temperature": params["temperature"],
+                   "num_predict": num_predict or llm_config.get("num_predict") or params["max_tokens"]}
+        if llm_config.get("num_ctx"):
+            options["num_ctx"] = llm_config["num_ctx"]
+        return {
+            "model": params["model"],
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": llm_config.get("keep_alive", "30m"),
+            "options": options
+        }
+
+    def _ollama_chat(self, messages: List[Dict], num_predict: int = None) -> str:
+        response = httpx.post(self.ollama_url("/api/chat"), json=self.ollama_payload(messages, False, num_predict),
+                              timeout=self.config.get("llm", {}).get("request_timeout", 300))
+        response.raise_for_status()
+        return response.json().get("message", {}).get("content", "")
+
+    def warm_up(self) -> bool:
+        # 先让 Ollama 把模型载入内存（messages 为空时只加载模型），再用固定系统提示词生成 1 个 token，
+        # 预先计算好提示词前缀的 KV 缓存
+        if not self.client:
+            return False
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": "你好"}]
+        try:
+            if self.is_ollama():
+                self._ollama_chat([])
+                self._ollama_chat(messages, num_predict=1)
+            else:
+                params = self.completion_params()
+                params["max_tokens"] = 1
+                self.client.chat.completions.create(messages=messages, **params)
+            logger.info("LLM warm-up finished")
+            return True
+        except Exception as e:
+            logger.warning("LLM warm-up failed: %s", e)
+            return False
+
+    @staticmethod
+    def _delta_text(chunk) -> str:
+        if not chunk.choices:
+            return ""
+        choice = chunk.choices[0]
+        if hasattr(choice, "delta") and choice.delta and choice.delta.content:
+            return choice.delta.content
+        if hasattr(choice, "message") and choice.message and choice.message.get("content"):
+            return choice.message["content"]
+        return ""
+
+    @staticmethod
+    def _ollama_delta(line: str) -> str:
+        # 原生接口按行返回 JSON，每行的 message.content 为一段增量
+        if not line:
+            return ""
+        data = json.loads(line)
+        if data.get("error"):
+            raise RuntimeError(data["error"])
+        return data.get("message", {}).get("content", "")
+
+    def _stream_deltas(self, messages: List[Dict]):
+        if self.is_ollama():
+            with httpx.stream("POST", self.ollama_url("/api/chat"), json=self.ollama_payload(messages, True),
+                              timeout=self.config.get("llm", {}).get("request_timeout", 300)) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    yield self._ollama_delta(line)
+            return
+        response = self.client.chat.completions.create(messages=messages, stream=True, **self.completion_params())
+        for chunk in response:
+            yield self._delta_text(chunk)
+
+    def generate_answer(self, query: str, context_chunks: List[Dict], stream: bool = False, trace=None,
+                        status: GenerationStatus = None):
+        trace = trace or tracer.current()
+        status = status or GenerationStatus()
+        with tracer.span("prompt_build", trace=trace, chunks=len(context_chunks)) as prompt_stats:
+            messages = self._build_messages(query, context_chunks, stats=prompt_stats)
         if not stream:
             if not self.client:
                 return "⚠️ LLM Client not initialized. Please configure API key in config.json."
             try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    stream=False
-                )
+                with tracer.span("llm_generate", trace=trace, stream=False):
+                    if self.is_ollama():
+                        return self._ollama_chat(messages)
+                    response = self.client.chat.completions.create(messages=messages, stream=False,
+                                                                   **self.completion_params())
                 return response.choices[0].message.content
             except Exception as e:
                 return f"❌ Error generating answer: {e}"
         else:
             def _stream():
                 if not self.client:
+                    status.set(GenerationStatus.ERROR, trace)
                     yield "⚠️ LLM Client not initialized. Please configure API key in config.json."
                     return
+                timer = GenerationTimer(trace)
                 try:
-                    response = self.client.chat.completions.create(
-                        model=model,
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        stream=True
-                    )
-                    for chunk in response:
-                        if hasattr(chunk.choices[0], "delta") and chunk.choices[0].delta and chunk.choices[0].delta.content:
-                            yield chunk.choices[0].delta.content
-                        elif hasattr(chunk.choices[0], "message") and chunk.choices[0].message and chunk.choices[0].message.get("content"):
-                            yield chunk.choices[0].message["content"]
+                    for text in self._stream_deltas(messages):
+                        if text:
+                            timer.token()
+                            yield text
+                    status.set(GenerationStatus.COMPLETED, trace)
                 except Exception as e:
+                    status.set(GenerationStatus.ERROR, trace)
                     yield f"❌ Error generating answer: {e}"
+                finally:
+                    timer.finish()
             return _stream()
+
+    def _get_http_client(self):
+        if self._http_client is None:
+            llm_config = self.config.get("llm", {})
+            pool_size = llm_config.get("pool_connections", 8)
+            # 所有协程共享一个 keep-alive 连接池，避免每次生成都重新建立到 Ollama 的连接
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(llm_config.get("request_timeout", 300), connect=10.0)
+            )
+        return self._http_client
+
+    def _get_async_client(self):
+        if self.async_client is None and self._client_kwargs and AsyncOpenAI is not None:
+            self.async_client = AsyncOpenAI(http_client=self._get_http_client(), **self._client_kwargs)
+        return self.async_client
+
+    async def _astream_deltas(self, messages: List[Dict]) -> AsyncIterator[str]:
+        # 用户离开或任务被取消时关闭响应流，Ollama 会随连接断开停止生成
+        if self.is_ollama():
+            async with self._get_http_client().stream(
+                "POST", self.ollama_url("/api/chat"), json=self.ollama_payload(messages, True)
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    yield self._ollama_delta(line)
+            return
+        response = await self._get_async_client().chat.completions.create(
+            messages=messages, stream=True, **self.completion_params()
+        )
+        try:
+            async for chunk in response:
+                yield self._delta_text(chunk)
+        finally:
+            await response.close()
+
+    async def agenerate_answer(self, query: str, context_chunks: List[Dict], trace=None,
+                               status: GenerationStatus = None) -> AsyncIterator[str]:
+        # 提示文字与回答一起流式输出，生成是否完整由 status 告知调用方
+        status = status or GenerationStatus()
+        client = self._get_async_client()
+        if client is None:
+            status.set(GenerationStatus.ERROR, trace)
+            yield "⚠️ LLM Client not initialized. Please configure API key in config.json."
+            return
+        llm_config = self.config.get("llm", {})
+        if self._waiting >= llm_config.get("max_queue", 16):
+            status.set(GenerationStatus.BUSY, trace)
+            yield "⚠️ 当前提问人数较多，请稍后再试。"
+            return
+        self._waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=llm_config.get("queue_timeout", 30))
+        except asyncio.TimeoutError:
+            status.set(GenerationStatus.BUSY, trace)
+            yield "⚠️ 排队等待超时，请稍后再试。"
+            return
+        finally:
+            self._waiting -= 1
+            tracer.record("llm_queue_wait", time.perf_counter() - queued_at, trace=trace, started=queued_at)
+        # 取得信号量之后的一切（包括提示词构建）都在 try 内，任何异常都会归还名额
+        self.in_flight += 1
+        timer = None
+        try:
+            with tracer.span("prompt_build", trace=trace, chunks=len(context_chunks)) as prompt_stats:
+                messages = self._build_messages(query, context_chunks, stats=prompt_stats)
+            deadline = time.monotonic() + llm_config.get("request_timeout", 300)
+            timer = GenerationTimer(trace)
+            deltas = self._astream_deltas(messages)
+            try:
+                async for text in deltas:
+                    if text:
+                        timer.token()
+                        yield text
+                    if time.monotonic() > deadline:
+                        status.set(GenerationStatus.TIMEOUT, trace)
+                        yield "\n\n⚠️ 生成超时，回答已截断。"
+                        break
+                else:
+                    status.set(GenerationStatus.COMPLETED, trace)
+            finally:
+                await deltas.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status.set(GenerationStatus.ERROR, trace)
+            yield f"❌ Error generating answer: {e}"
+        finally:
+            if timer is not None:
+                timer.finish()
+            self.in_flight -= 1
+            self._semaphore.release()
@@ -0,0 +1,80 @@
+import os
+import sys
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+ROOT_LOGGER = "zju"
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+_setup_lock = threading.Lock()
+_listener = None
+
+class SamplingFilter(logging.Filter):
+    """按消息模板抽样 WARNING 以下的日志：采样率 0.1 表示同一条消息每 10 次输出 1 次"""
+
+    def __init__(self, default_rate: float = 1.0, rates: Dict[str, float] = None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = dict(rates or {})
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _rate_for(self, name: str) -> float:
+        # 取最长匹配的 logger 名前缀，例如 "zju.vector_db" 同时作用于 "zju.vector_db.query"
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return self.default_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        every = max(1, round(1 / rate))
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counters.get(key, 0)
+            self._counters[key] = count + 1
+        return count % every == 0
+
+def setup_logging(logging_config: Dict = None):
+    """配置 zju.* 日志：调用线程只把记录放入队列，由后台监听线程写控制台或文件。重复调用时只生效第一次"""
+    global _listener
+    logging_config = logging_config or {}
+    with _setup_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(str(logging_config.get("level", "INFO")).upper())
+        root.propagate = False
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = [logging.StreamHandler(sys.stdout)]
+        log_file = logging_config.get("file")
+        if log_file:
+            os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+            handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        queue_handler = QueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(SamplingFilter(
+            logging_config.get("sample_rate", 1.0), logging_config.get("sample_rates", {})
+        ))
+        root.handlers = [queue_handler]
+        _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # 进程退出前把队列中剩余的日志写完
+        atexit.register(_listener.stop)
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
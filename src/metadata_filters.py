@@ -0,0 +1,96 @@
+import re
+from typing import Any, Dict, Optional
+from data_processing.metadata_extractor import MetadataExtractor
+
+# Chroma 的元数据只接受标量，列表字段以分隔符拼接存储，查询结果再还原为列表
+LIST_FIELDS = ("persons", "locations", "time_periods", "institutions", "events")
+LIST_SEPARATOR = "|"
+FLAG_PREFIXES = {
+    "persons": "person_",
+    "locations": "location_",
+    "time_periods": "period_"
+}
+DOCUMENT_FIELDS = ("section_title", "section_level", "time_period", "chunk_type", "source",
+                   "quality_score", "word_count", "process_time")
+YEAR_PATTERN = re.compile(r'(?<!\d)(\d{4})(?!\d)')
+
+_PERIOD_RANGES = {name: (int(start), int(end)) for name, (start, end) in MetadataExtractor().time_periods.items()}
+
+def _scalar(value: Any) -> Any:
+    if isinstance(value, (bool, int, float)):
+        return value
+    return str(value)
+
+def flatten_metadata(doc: Dict[str, Any]) -> Dict[str, Any]:
+    metadata = doc.get('metadata', {}) or {}
+    flat = {}
+    years = []
+    for k, v in metadata.items():
+        if v is None:
+            continue
+        if k in LIST_FIELDS and isinstance(v, (list, tuple, set)):
+            values = sorted({str(item) for item in v if item})
+            if values:
+                flat[k] = LIST_SEPARATOR.join(values)
+            prefix = FLAG_PREFIXES.get(k)
+            if prefix:
+                for item in values:
+                    flat[prefix + item] = True
+            if k == "time_periods":
+                for item in values:
+                    years.extend(int(y) for y in YEAR_PATTERN.findall(item))
+                    years.extend(_PERIOD_RANGES.get(item, ()))
+        elif isinstance(v, (list, dict)):
+            flat[k] = str(v)
+        else:
+            flat[k] = _scalar(v)
+    for k in DOCUMENT_FIELDS:
+        if doc.get(k) not in (None, "") and k not in flat:
+            flat[k] = _scalar(doc[k])
+    if years:
+        flat["start_year"] = min(years)
+        flat["end_year"] = max(years)
+    if 'id' in doc and 'id' not in flat:
+        flat['original_id'] = str(doc['id'])
+    return flat
+
+def expand_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not metadata:
+        return {}
+    prefixes = tuple(FLAG_PREFIXES.values())
+    expanded = {}
+    for k, v in metadata.items():
+        if k.startswith(prefixes) and v is True:
+            continue
+        if k in LIST_FIELDS and isinstance(v, str):
+            expanded[k] = [item for item in v.split(LIST_SEPARATOR) if item]
+        else:
+            expanded[k] = v
+    return expanded
+
+# 结构化过滤条件 -> Chroma where 表达式：
+# persons / locations / time_periods 为列表，同一字段内任一命中即可；
+# year_range 为 (起始年, 结束年)，与块的年份区间有交集即命中；source 为来源名称
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict]:
+    if not filters:
+        return None
+    conditions = []
+    for field, prefix in FLAG_PREFIXES.items():
+        values = filters.get(field) or []
+        clauses = [{prefix + value: True} for value in dict.fromkeys(values)]
+        if len(clauses) == 1:
+            conditions.append(clauses[0])
+        elif clauses:
+            conditions.append({"$or": clauses})
+    year_range = filters.get("year_range")
+    if year_range:
+        start, end = year_range
+        conditions.append({"start_year": {"$lte": int(end)}})
+        conditions.append({"end_year": {"$gte": int(start)}})
+    if filters.get("source"):
+        conditions.append({"source": filters["source"]})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
@@ -0,0 +1,108 @@
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional
+from query_cache import LRUCache, normalize_query
+from log_utils import get_logger
+
+logger = get_logger("reranker")
+
+class CrossEncoderReranker:
+    """用本地交叉编码器对向量检索的候选重新排序
+
+    候选与问题成对一次性批量打分，分数按（问题，文本块 id）缓存；
+    超过时间预算时直接返回原检索顺序，后台仍完成打分并写入缓存，同一问题下次可直接命中。
+    后台打分尚未结束时，新的请求不再排队，直接沿用检索顺序，避免一次慢批次拖垮后续所有请求。
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, max_length: int = 256,
+                 time_budget: float = 0.5, cache_size: int = 4096, device: str = "cpu", model=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        if model is None:
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self.model = model
+        self.score_cache = LRUCache(max_size=cache_size)
+        # 单线程执行打分：模型推理本身已占满 CPU，多个请求排队比并发推理更快
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="zju-rerank")
+        self._pending = None
+        self._pending_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, rerank_config: Dict) -> Optional["CrossEncoderReranker"]:
+        if not rerank_config.get("enabled", True):
+            return None
+        try:
+            return cls(
+                rerank_config.get("model", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"),
+                batch_size=rerank_config.get("batch_size", 32),
+                max_length=rerank_config.get("max_length", 256),
+                time_budget=rerank_config.get("time_budget", 0.5),
+                cache_size=rerank_config.get("cache_size", 4096),
+                device=rerank_config.get("device", "cpu")
+            )
+        except Exception as e:
+            logger.warning("Reranker unavailable (%s), keeping retrieval order", e)
+            return None
+
+    def _score(self, query_key: str, query: str, pending: List[Dict]) -> Dict[str, float]:
+        scores = self.model.predict(
+            [(query, result['document'].get('content', '')) for result in pending],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        scored = {}
+        for result, score in zip(pending, scores):
+            chunk_id = result['document']['id']
+            scored[chunk_id] = float(score)
+            self.score_cache.set((query_key, chunk_id), float(score))
+        return scored
+
+    def rerank(self, query: str, results: List[Dict], top_k: int, stats: Dict = None) -> List[Dict]:
+        if not results:
+            return results
+        started = time.perf_counter()
+        query_key = normalize_query(query)
+        scores = {}
+        pending = []
+        for result in results:
+            chunk_id = result['document']['id']
+            score = self.score_cache.get((query_key, chunk_id))
+            if score is None:
+                pending.append(result)
+            else:
+                scores[chunk_id] = score
+        timed_out = busy = False
+        if pending:
+            with self._pending_lock:
+                busy = self._pending is not None and not self._pending.done()
+                if not busy:
+                    future = self._pending = self._executor.submit(self._score, query_key, query, pending)
+            if busy:
+                timed_out = True
+            else:
+                try:
+                    scores.update(future.result(timeout=max(0.0, self.time_budget - (time.perf_counter() - started))))
+                except FutureTimeout:
+                    # 尚未开始的任务直接取消；已在运行的留在后台完成并写入缓存，期间的新请求不再排队
+                    future.cancel()
+                    timed_out = True
+                except Exception as e:
+                    logger.warning("Rerank failed (%s), keeping retrieval order", e)
+                    timed_out = True
+        if stats is not None:
+            stats.update({"candidates": len(results), "cached": len(results) - len(pending),
+                          "timed_out": timed_out, "busy": busy})
+        if timed_out:
+            logger.debug("Rerank exceeded %.2fs budget, keeping retrieval order", self.time_budget)
+            return results[:top_k]
+        # similarity 保留检索得分；交叉编码器输出的是 logit，另存一份 sigmoid 后的 0~1 相关度用于展示和 MMR
+        for result in results:
+            score = scores[result['document']['id']]
+            result['rerank_score'] = score
+            result['rerank_relevance'] = 1.0 / (1.0 + math.exp(-score))
+        # sorted 是稳定排序，同分时保持检索顺序
+        return sorted(results, key=lambda result: result['rerank_score'], reverse=True)[:top_k]
@@ -0,0 +1,88 @@
+import os, sys
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(ROOT)
+import glob
+import json
+import time
+import argparse
+from document_cleaner import ZJUDocumentCleaner, CLEANING_STAGES
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="文档清洗吞吐基准：多遍清洗 vs 单遍清洗")
+    parser.add_argument("--input-glob", default=os.path.join(ROOT, "raw_data", "documents", "*"),
+                        help="语料文件（跳过 cleaned_ 前缀的清洗结果）")
+    parser.add_argument("--size-mb", type=float, default=1024, help="把语料重复到的总大小（UTF-8 MB）")
+    parser.add_argument("--structure", action="store_true", help="同时计入段落结构化（时间与实体提取）")
+    parser.add_argument("--output", default="benchmark_cleaner_report.json", help="JSON 报告路径")
+    return parser.parse_args()
+
+def load_corpus(input_glob):
+    documents = []
+    for filepath in sorted(glob.glob(input_glob)):
+        if os.path.basename(filepath).startswith("cleaned_") or not os.path.isfile(filepath):
+            continue
+        with open(filepath, "r", encoding="utf-8") as f:
+            documents.append(f.read())
+    return documents
+
+def multi_pass(cleaner, content):
+    for stage in CLEANING_STAGES[:-1]:
+        content = getattr(cleaner, stage)(content)
+    return [p.strip() for p in content.split('\n\n') if p.strip()]
+
+def run(clean, documents, total_bytes, structure, cleaner):
+    started = time.perf_counter()
+    paragraphs = 0
+    for content in documents:
+        cleaned = clean(content)
+        if structure:
+            cleaned = cleaner.structure_paragraphs(cleaned)["paragraphs"]
+        paragraphs += len(cleaned)
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 3),
+        "mb_per_second": round(total_bytes / elapsed / 1024 / 1024, 2),
+        "paragraphs": paragraphs
+    }
+
+def main():
+    args = parse_args()
+    corpus = load_corpus(args.input_glob)
+    if not corpus:
+        print(f"❌ 未找到语料：{args.input_glob}")
+        return
+    cleaner = ZJUDocumentCleaner()
+    # 先确认两种实现在原始语料上输出一致
+    for content in corpus:
+        if multi_pass(cleaner, content) != cleaner.clean_paragraphs(content):
+            print("❌ 单遍清洗与多遍清洗结果不一致")
+            return
+
+    corpus_bytes = sum(len(content.encode("utf-8")) for content in corpus)
+    repeat = max(1, round(args.size_mb * 1024 * 1024 / corpus_bytes))
+    # 重复引用同一批字符串，不额外占用内存；每个文档仍独立清洗
+    documents = corpus * repeat
+    total_bytes = corpus_bytes * repeat
+    print(f"[Benchmark] {len(corpus)} 个文档 × {repeat} = {total_bytes / 1024 / 1024:.1f} MB")
+
+    report = {
+        "settings": {"documents": len(documents), "total_mb": round(total_bytes / 1024 / 1024, 1),
+                     "structure": args.structure},
+        "engines": {}
+    }
+    for name, clean in (("multi_pass", lambda content: multi_pass(cleaner, content)),
+                        ("single_pass", cleaner.clean_paragraphs)):
+        result = run(clean, documents, total_bytes, args.structure, cleaner)
+        report["engines"][name] = result
+        print(f"  {name}: {result['mb_per_second']} MB/s ({result['seconds']}s)")
+    speedup = report["engines"]["multi_pass"]["seconds"] / report["engines"]["single_pass"]["seconds"]
+    report["speedup"] = round(speedup, 2)
+    print(f"  加速比: {speedup:.2f}x")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n[Benchmark] 报告已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
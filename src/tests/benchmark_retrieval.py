@@ -0,0 +1,175 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from data_processing.chunk_io import iter_chunks
+from vector_db import create_vector_db
+
+QRELS_PATH = os.path.join(os.path.dirname(__file__), "retrieval_qrels.json")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="检索延迟、吞吐与召回质量基准")
+    parser.add_argument("--qrels", default=QRELS_PATH, help="标注问题集：question + relevant_ids")
+    parser.add_argument("--targets", default="vector,smart",
+                        help="逗号分隔：vector = SimpleVectorDB.query，smart = smart_query 的检索阶段")
+    parser.add_argument("--k", default="1,3,5,10", help="计算 recall@k 的 k 值")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="吞吐测试的并发线程数")
+    parser.add_argument("--repeat", type=int, default=3, help="每个问题重复的次数")
+    parser.add_argument("--mode", default=None, help="覆盖 retrieval.mode（hybrid / vector）")
+    parser.add_argument("--warm-cache", action="store_true", help="保留查询向量、结果与重排序分数缓存（默认全部关闭以测量真实检索开销）")
+    parser.add_argument("--with-llm", action="store_true", help="额外测量 smart_query 含回答生成的端到端延迟")
+    parser.add_argument("--output", default="benchmark_retrieval_report.json", help="JSON 报告路径")
+    return parser.parse_args()
+
+def load_qrels(path, chunks_path):
+    with open(path, "r", encoding="utf-8") as f:
+        qrels = json.load(f)
+    known_ids = {str(chunk['id']) for chunk in iter_chunks(chunks_path)}
+    for item in qrels:
+        missing = [chunk_id for chunk_id in item['relevant_ids'] if chunk_id not in known_ids]
+        if missing:
+            print(f"[WARN] 标注中的文本块不存在（分块结果可能已变化）：{item['question']} -> {missing}")
+    return qrels
+
+def percentiles(latencies):
+    values = np.asarray(latencies) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+def timed(search, question):
+    started = time.perf_counter()
+    search(question)
+    return time.perf_counter() - started
+
+def evaluate_quality(search, qrels, ks):
+    per_question = []
+    for item in qrels:
+        ranked = [result['document']['id'] for result in search(item['question'])]
+        relevant = set(item['relevant_ids'])
+        first_hit = next((rank for rank, chunk_id in enumerate(ranked, start=1) if chunk_id in relevant), None)
+        per_question.append({
+            "question": item['question'],
+            "retrieved": ranked,
+            "recall": {f"@{k}": len(relevant & set(ranked[:k])) / len(relevant) for k in ks},
+            "reciprocal_rank": 1.0 / first_hit if first_hit else 0.0
+        })
+    return {
+        "recall": {f"@{k}": round(float(np.mean([q['recall'][f"@{k}"] for q in per_question])), 4) for k in ks},
+        "mrr": round(float(np.mean([q['reciprocal_rank'] for q in per_question])), 4),
+        "per_question": per_question
+    }
+
+def measure_latency(search, questions, repeat):
+    # 先预热一轮，排除模型加载与索引构建的一次性开销
+    for question in questions:
+        search(question)
+    return percentiles([timed(search, question) for _ in range(repeat) for question in questions])
+
+def measure_throughput(search, questions, repeat, levels):
+    workload = [question for _ in range(repeat) for question in questions]
+    report = {}
+    for level in levels:
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            started = time.perf_counter()
+            latencies = list(pool.map(lambda question: timed(search, question), workload))
+            elapsed = time.perf_counter() - started
+        report[str(level)] = {"qps": round(len(workload) / elapsed, 2), "latency": percentiles(latencies)}
+        print(f"  并发 {level}: {report[str(level)]['qps']} QPS, p95 {report[str(level)]['latency']['p95_ms']} ms")
+    return report
+
+def run_target(name, search, qrels, args, ks, levels):
+    print(f"\n[Benchmark] {name}")
+    questions = [item['question'] for item in qrels]
+    quality = evaluate_quality(search, qrels, ks)
+    print(f"  recall: {quality['recall']}, MRR: {quality['mrr']}")
+    latency = measure_latency(search, questions, args.repeat)
+    print(f"  latency p50/p95/p99: {latency['p50_ms']}/{latency['p95_ms']}/{latency['p99_ms']} ms")
+    throughput = measure_throughput(search, questions, args.repeat, levels)
+    return {"quality": quality, "latency": latency, "throughput": throughput}
+
+def main():
+    args = parse_args()
+    ks = [int(k) for k in args.k.split(",")]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    top_k = max(ks)
+
+    system = None
+    if "smart" in targets:
+        from web_app import EnhancedZJUHistorySystem
+        system = EnhancedZJUHistorySystem()
+        vector_db = system.vector_db
+    else:
+        vector_db = create_vector_db()
+    if args.mode:
+        vector_db.retrieval_mode = args.mode
+    reranker = system.reranker if system is not None else None
+    if not args.warm_cache:
+        vector_db.embedding_cache.max_size = 0
+        vector_db.result_cache.max_size = 0
+        vector_db.result_cache.clear()
+        vector_db.embedding_cache.clear()
+        # 冷启动测量不经过任何向量缓存：磁盘缓存只服务建库，这里显式断开以防查询向量从磁盘取回
+        vector_db.embedding_fn.cache = None
+        if reranker is not None:
+            reranker.score_cache.max_size = 0
+            reranker.score_cache.clear()
+    if system is not None and system.answer_cache is not None and args.with_llm:
+        system.answer_cache = None
+
+    qrels = load_qrels(args.qrels, vector_db.chunks_path)
+    report = {
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {
+            "retrieval_mode": vector_db.retrieval_mode,
+            "embedding_model": vector_db.embedding_model_id,
+            "hybrid_candidates": vector_db.hybrid_candidates,
+            "collection_count": vector_db.count(),
+            "shards": vector_db.shard_stats() if hasattr(vector_db, "shard_stats") else None,
+            "index_version": vector_db.index_version,
+            "questions": len(qrels),
+            "repeat": args.repeat,
+            "top_k": top_k,
+            "warm_cache": args.warm_cache,
+            "caches": {
+                "query_embedding_lru": vector_db.embedding_cache.max_size > 0,
+                "embedding_disk": vector_db.embedding_fn.cache is not None,
+                "result_lru": vector_db.result_cache.max_size > 0,
+                "rerank_scores": reranker is not None and reranker.score_cache.max_size > 0,
+                "answer_cache": system is not None and system.answer_cache is not None
+            },
+            "reranker": system.reranker.model_name if system is not None and system.reranker else None
+        },
+        "targets": {}
+    }
+    if "vector" in targets:
+        report["targets"]["vector_db.query"] = run_target(
+            "SimpleVectorDB.query", lambda q: vector_db.query(q, n_results=top_k), qrels, args, ks, levels
+        )
+    if system is not None:
+        report["targets"]["smart_query.retrieve"] = run_target(
+            "EnhancedZJUHistorySystem.smart_query（检索阶段）", lambda q: system.retrieve(q, top_k)[0],
+            qrels, args, ks, levels
+        )
+        if args.with_llm:
+            print("\n[Benchmark] smart_query 端到端（含回答生成）")
+            latency = percentiles([timed(lambda q: list(system.smart_query(q)), item['question']) for item in qrels])
+            print(f"  latency p50/p95/p99: {latency['p50_ms']}/{latency['p95_ms']}/{latency['p99_ms']} ms")
+            report["targets"]["smart_query.end_to_end"] = {"latency": latency}
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"\n[Benchmark] 报告已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import time
+from reranker import CrossEncoderReranker
+
+class SlowModel:
+    """按文本长度打分的假交叉编码器，delay 秒后才返回"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [len(content) for _, content in pairs]
+
+def make_results(contents):
+    return [{"document": {"id": f"doc_{i}", "content": content}, "similarity": 1.0 - i * 0.1}
+            for i, content in enumerate(contents)]
+
+def test_back_to_back_timeouts():
+    model = SlowModel(delay=0.6)
+    reranker = CrossEncoderReranker("fake", time_budget=0.1, model=model)
+    contents = ["短", "较长的一段", "最长的一段文本内容"]
+
+    started = time.perf_counter()
+    first = reranker.rerank("问题一", make_results(contents), top_k=2)
+    assert [r["document"]["id"] for r in first] == ["doc_0", "doc_1"]
+    assert time.perf_counter() - started < 0.3
+
+    # 上一批仍在后台打分：第二个请求不排队，同样在预算内按检索顺序返回
+    started = time.perf_counter()
+    stats = {}
+    second = reranker.rerank("问题二", make_results(contents), top_k=2, stats=stats)
+    assert time.perf_counter() - started < 0.3
+    assert stats["busy"] and stats["timed_out"]
+    assert [r["document"]["id"] for r in second] == ["doc_0", "doc_1"]
+    assert model.calls == 1
+
+    # 后台打分完成后写入缓存，同一问题直接按交叉编码器分数排序
+    time.sleep(0.8)
+    model.delay = 0.0
+    third = reranker.rerank("问题一", make_results(contents), top_k=2)
+    assert [r["document"]["id"] for r in third] == ["doc_2", "doc_1"]
+    assert [r["similarity"] for r in third] == [0.8, 0.9]
+    assert third[0]["rerank_score"] == 9 and 0.5 < third[1]["rerank_relevance"] < third[0]["rerank_relevance"] < 1
+    assert model.calls == 1
+    fourth = reranker.rerank("问题二", make_results(contents), top_k=2)
+    assert [r["document"]["id"] for r in fourth] == ["doc_2", "doc_1"]
+    assert model.calls == 2
+
+if __name__ == "__main__":
+    test_back_to_back_timeouts()
+    print("test_back_to_back_timeouts passed")
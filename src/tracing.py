@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import uuid
+import queue
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from log_utils import get_logger
+
+# 阶段耗时（秒）的直方图分桶，覆盖从毫秒级检索到分钟级生成
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+
+logger = get_logger("tracing")
+_current_trace = contextvars.ContextVar("zju_current_trace", default=None)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+class Trace:
+    def __init__(self, name: str, attributes: Dict = None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, started: float, duration: float, attributes: Dict):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "offset_ms": round((started - self.started) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+                **({"attributes": attributes} if attributes else {})
+            })
+
+    def to_dict(self, duration: float, status: str) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["offset_ms"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(duration * 1000, 3),
+            "status": status,
+            "attributes": self.attributes,
+            "spans": spans
+        }
+
+class Tracer:
+    def __init__(self):
+        self.enabled = True
+        self.export_path = None
+        self._metrics_lock = threading.Lock()
+        self._stage_latency: Dict[str, Histogram] = {}
+        self._token_rate = Histogram(TOKEN_RATE_BUCKETS)
+        self._tokens_total = 0
+        self._traces_total: Dict[str, Dict[str, int]] = {}
+        self._export_queue = None
+        self._metrics_server = None
+
+    def configure(self, tracing_config: Dict):
+        self.enabled = tracing_config.get("enabled", True)
+        self.export_path = tracing_config.get("path") or None
+        if self.enabled and self.export_path and self._export_queue is None:
+            # 追踪记录交给后台线程写文件，请求线程只做入队
+            self._export_queue = queue.Queue(maxsize=tracing_config.get("queue_size", 10000))
+            threading.Thread(target=self._export_loop, name="zju-trace-export", daemon=True).start()
+        port = tracing_config.get("metrics_port")
+        if self.enabled and port and self._metrics_server is None:
+            self.start_metrics_server(tracing_config.get("metrics_host", "127.0.0.1"), port)
+
+    def current(self) -> Optional[Trace]:
+        return _current_trace.get()
+
+    def start_trace(self, name: str, **attributes) -> Optional[Trace]:
+        return Trace(name, attributes) if self.enabled else None
+
+    @contextmanager
+    def activate(self, trace: Optional[Trace]):
+        # 在同步代码块内把 trace 设为当前追踪，vector_db 等下游模块据此记录子阶段
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+    def finish(self, trace: Optional[Trace], status: str = "ok"):
+        if trace is None:
+            return
+        duration = time.perf_counter() - trace.started
+        self.observe(trace.name, duration)
+        with self._metrics_lock:
+            by_status = self._traces_total.setdefault(trace.name, {})
+            by_status[status] = by_status.get(status, 0) + 1
+        if self._export_queue is not None:
+            try:
+                self._export_queue.put_nowait(trace.to_dict(duration, status))
+            except queue.Full:
+                pass
+
+    @contextmanager
+    def span(self, name: str, trace: Optional[Trace] = None, **attributes):
+        if not self.enabled:
+            yield attributes
+            return
+        started = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.record(name, time.perf_counter() - started, trace=trace, started=started, **attributes)
+
+    def record(self, name: str, duration: float, trace: Optional[Trace] = None, started: float = None, **attributes):
+        if not self.enabled:
+            return
+        self.observe(name, duration)
+        trace = trace or _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, started if started is not None else time.perf_counter() - duration, duration, attributes)
+
+    def observe(self, stage: str, duration: float):
+        with self._metrics_lock:
+            histogram = self._stage_latency.get(stage)
+            if histogram is None:
+                histogram = self._stage_latency[stage] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+
+    def record_generation(self, tokens: int, duration: float, trace: Optional[Trace] = None):
+        rate = tokens / duration if duration > 0 else 0.0
+        with self._metrics_lock:
+            self._tokens_total += tokens
+            if tokens:
+                self._token_rate.observe(rate)
+        trace = trace or _current_trace.get()
+        if trace is not None:
+            trace.attributes["completion_tokens"] = trace.attributes.get("completion_tokens", 0) + tokens
+            trace.attributes["tokens_per_second"] = round(rate, 2)
+        return rate
+
+    def render_metrics(self) -> str:
+        lines = [
+            "# HELP zju_stage_duration_seconds Duration of each query stage.",
+            "# TYPE zju_stage_duration_seconds histogram"
+        ]
+        with self._metrics_lock:
+            for stage in sorted(self._stage_latency):
+                lines.extend(self._stage_latency[stage].render("zju_stage_duration_seconds", f'stage="{stage}"'))
+            lines += [
+                "# HELP zju_llm_tokens_per_second Streaming generation speed per answer.",
+                "# TYPE zju_llm_tokens_per_second histogram"
+            ]
+            lines.extend(self._token_rate.render("zju_llm_tokens_per_second", 'model="all"'))
+            lines += [
+                "# HELP zju_llm_completion_tokens_total Streamed completion tokens.",
+                "# TYPE zju_llm_completion_tokens_total counter",
+                f"zju_llm_completion_tokens_total {self._tokens_total}",
+                "# HELP zju_traces_total Finished traces by name and status.",
+                "# TYPE zju_traces_total counter"
+            ]
+            for name in sorted(self._traces_total):
+                for status, count in sorted(self._traces_total[name].items()):
+                    lines.append(f'zju_traces_total{{name="{name}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def start_metrics_server(self, host: str, port: int):
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.render_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.warning("Metrics endpoint unavailable on %s:%s: %s", host, port, e)
+            return
+        threading.Thread(target=self._metrics_server.serve_forever, name="zju-metrics", daemon=True).start()
+        logger.info("Prometheus metrics at http://%s:%s/metrics", host, port)
+
+    def _export_loop(self):
+        os.makedirs(os.path.dirname(self.export_path) or ".", exist_ok=True)
+        with open(self.export_path, "a", encoding="utf-8") as f:
+            while True:
+                record = self._export_queue.get()
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                # 队列暂时清空时才刷盘，高负载下合并写入
+                if self._export_queue.empty():
+                    f.flush()
+
+tracer = Tracer()
@@ -1,111 +1,687 @@
 import os
+import json
+import copy
+import time
+import hashlib
+import threading
 import chromadb
-from chromadb.utils import embedding_functions
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Optional
+from query_cache import LRUCache, normalize_query
+from app_config import load_config
+from hybrid_search import BM25Index, reciprocal_rank_fusion, maximal_marginal_relevance
+from metadata_filters import flatten_metadata, expand_metadata, build_where
+from embeddings import create_embedding_function
+from data_processing.metadata_extractor import MetadataExtractor
+from tracing import tracer
+from log_utils import get_logger, setup_logging
+
+INDEX_VERSION_FILE = "index_version"
+SHARD_ROUTES = ("source", "period")
+UNKNOWN_SOURCE_SHARD = "未知来源"
+UNDATED_SHARD = "未标注年代"
+logger = get_logger("vector_db")
 
 class SimpleVectorDB:
-    def __init__(self, db_path="./chroma_db", collection_name="zju_history"):
+    def __init__(self, db_path="./chroma_db", collection_name="zju_history", batch_size=64,
+                 embedding_cache_size=1024, result_cache_size=256, cache_ttl=3600,
+                 retrieval_mode=None, config_path="config.json"):
         self.db_path = db_path
         self.collection_name = collection_name
-        print("Connecting to ChromaDB...")
+        self.batch_size = batch_size
+        config = load_config(config_path)
+        setup_logging(config.get("logging"))
+        retrieval_config = config.get("retrieval", {})
+        self.retrieval_mode = retrieval_mode or retrieval_config.get("mode", "vector")
+        self.chunks_path = retrieval_config.get("chunks_path", "processed_data/optimized_chunks.jsonl")
+        self.chunk_store_path = retrieval_config.get("chunk_store_path", "processed_data/chunk_store")
+        self.hybrid_candidates = retrieval_config.get("candidates", 20)
+        self.rrf_k = retrieval_config.get("rrf_k", 60)
+        self.mmr_candidates = retrieval_config.get("mmr_candidates", 20)
+        self._bm25 = None
+        self._bm25_unavailable = False
+        self._bm25_lock = threading.Lock()
+        # 查询向量只取决于文本和模型，结果集则在集合写入后失效
+        self.embedding_cache = LRUCache(max_size=embedding_cache_size, ttl=cache_ttl)
+        self.result_cache = LRUCache(max_size=result_cache_size, ttl=cache_ttl)
+        self._seen_index_version = self.index_version
+        logger.info("Connecting to ChromaDB at %s", db_path)
         self.client = chromadb.PersistentClient(path=db_path)
-        print("Using DefaultEmbeddingFunction (all-MiniLM-L6-v2)...")
-        self.embedding_fn = embedding_functions.DefaultEmbeddingFunction()
-        self.collection = self.client.get_or_create_collection(
-            name=collection_name,
-            embedding_function=self.embedding_fn
+        embedding_config = config.get("embedding", {})
+        self.embedding_fn = create_embedding_function(
+            embedding_config, cache_path=os.path.join(db_path, "embedding_cache.sqlite")
         )
+        self.embedding_model_id = self.embedding_fn.model_id
+        logger.info("Using embedding backend %s", self.embedding_model_id)
+        self.collection = self._open_collection()
 
-    def add_documents(self, documents: List[Dict[str, Any]]):
-        if not documents:
-            print("[WARN] No documents to add")
-            return
-        print(f"Processing {len(documents)} documents for ChromaDB...")
-        ids = []
-        contents = []
-        metadatas = []
-        for doc in documents:
+    def _open_collection(self):
+        try:
+            return self.client.get_or_create_collection(
+                name=self.collection_name,
+                embedding_function=self.embedding_fn
+            )
+        except Exception as e:
+            # 集合由其他向量模型建立：写入和查询都显式传入向量，仍可打开，重建时再整体替换
+            logger.warning("Collection '%s' was built with another embedding function (%s); "
+                           "run build_vector_db.py to re-embed it", self.collection_name, e)
+            return self.client.get_collection(name=self.collection_name)
+
+    def reset_collection(self):
+        try:
+            self.client.delete_collection(name=self.collection_name)
+        except Exception as e:
+            logger.warning("Failed to delete collection '%s': %s", self.collection_name, e)
+        self.collection = self._open_collection()
+        self._invalidate()
+        logger.info("Collection '%s' reset for %s", self.collection_name, self.embedding_model_id)
+
+    def add_documents(self, documents: Iterable[Dict[str, Any]], batch_size: int = None) -> List[str]:
+        batch_size = max(1, batch_size or self.batch_size)
+        total = len(documents) if hasattr(documents, '__len__') else None
+        if total == 0:
+            logger.warning("No documents to add")
+            return []
+        logger.info("Processing %s documents for ChromaDB (batch size %d)",
+                    total if total is not None else "streamed", batch_size)
+        written_ids = []
+        doc_count = 0
+        embed_total = 0.0
+        write_total = 0.0
+        start_time = time.perf_counter()
+        # 单线程流水线：写入第 i 批的同时向量化第 i+1 批，内存中最多保留两批
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = None
+            for batch_no, batch in enumerate(self._iter_batches(documents, batch_size), start=1):
+                if batch_no == 1 and batch[2]:
+                    logger.debug("First metadata sample: %s", batch[2][0])
+                future = pool.submit(self._embed_batch, batch)
+                if pending is not None:
+                    stats = self._finish_batch(*pending)
+                    written_ids.extend(stats[0])
+                    embed_total += stats[1]
+                    write_total += stats[2]
+                doc_count += len(batch[0])
+                pending = (batch_no, batch, future)
+            if pending is not None:
+                stats = self._finish_batch(*pending)
+                written_ids.extend(stats[0])
+                embed_total += stats[1]
+                write_total += stats[2]
+        elapsed = time.perf_counter() - start_time
+        rate = doc_count / elapsed if elapsed > 0 else 0.0
+        if written_ids:
+            self._invalidate()
+        logger.info("Successfully added/updated %d/%d documents in ChromaDB "
+                    "(%.2fs, %.1f docs/s, embed %.2fs, write %.2fs)",
+                    len(written_ids), doc_count, elapsed, rate, embed_total, write_total)
+        return written_ids
+
+    def _iter_batches(self, documents: Iterable[Dict[str, Any]], batch_size: int):
+        ids, contents, metadatas = [], [], []
+        for position, doc in enumerate(documents, start=1):
             doc_id = doc.get('id')
             if not doc_id:
-                doc_id = f"doc_{len(ids)+1}"
+                doc_id = f"doc_{position}"
             ids.append(str(doc_id))
             contents.append(str(doc.get('content', '')))
-            metadata = doc.get('metadata', {})
-            clean_meta = {}
-            for k, v in metadata.items():
-                if v is None:
-                    continue
-                clean_meta[k] = str(v) if not isinstance(v, (list, dict)) else v
-            if 'id' in doc and 'id' not in clean_meta:
-                clean_meta['original_id'] = doc['id']
-            metadatas.append(clean_meta)
-        if len(metadatas) > 0:
-            print(f"Debug: First metadata sample: {metadatas[0]}")
+            metadatas.append(flatten_metadata(doc))
+            if len(ids) >= batch_size:
+                yield ids, contents, metadatas
+                ids, contents, metadatas = [], [], []
+        if ids:
+            yield ids, contents, metadatas
+
+    def _embed_batch(self, batch):
+        start_time = time.perf_counter()
+        try:
+            embeddings = self.embedding_fn(batch[1])
+        except Exception as e:
+            logger.error("Failed to embed batch of %d documents: %s", len(batch[1]), e)
+            embeddings = None
+        return embeddings, time.perf_counter() - start_time
+
+    def _finish_batch(self, batch_no, batch, future):
+        embeddings, embed_time = future.result()
+        ids, contents, metadatas = batch
+        start_time = time.perf_counter()
+        written = self._write_batch(ids, contents, metadatas, embeddings)
+        write_time = time.perf_counter() - start_time
+        rate = len(ids) / (embed_time + write_time) if embed_time + write_time > 0 else 0.0
+        logger.info("Batch %d: %d/%d docs, embed %.2fs, write %.2fs, %.1f docs/s",
+                    batch_no, len(written), len(ids), embed_time, write_time, rate)
+        return written, embed_time, write_time
+
+    def _write_batch(self, ids, contents, metadatas, embeddings) -> List[str]:
+        return self._upsert_batch(self.collection, ids, contents, metadatas, embeddings)
+
+    def _upsert_batch(self, collection, ids, contents, metadatas, embeddings) -> List[str]:
+        try:
+            collection.upsert(documents=contents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+            return list(ids)
+        except Exception as e:
+            if len(ids) > 1:
+                # 批量失败时二分重试，已计算的向量随之切分，不会重新向量化
+                mid = len(ids) // 2
+                logger.warning("Upsert of %d documents failed (%s), splitting into %d+%d", len(ids), e, mid, len(ids) - mid)
+                second = embeddings[mid:] if embeddings is not None else None
+                first = embeddings[:mid] if embeddings is not None else None
+                return (self._upsert_batch(collection, ids[:mid], contents[:mid], metadatas[:mid], first)
+                        + self._upsert_batch(collection, ids[mid:], contents[mid:], metadatas[mid:], second))
+            logger.error("Error adding doc (ID: %s): %s", ids[0], e)
+            try:
+                collection.upsert(documents=contents, ids=ids, embeddings=embeddings)
+                logger.warning("Added doc %s without metadata", ids[0])
+                return list(ids)
+            except Exception:
+                logger.error("Failed to add doc %s even without metadata", ids[0])
+                return []
+
+    def delete_documents(self, ids: List[str], routes: Dict[str, str] = None):
+        if not ids:
+            return
         try:
-            self.collection.upsert(documents=contents, metadatas=metadatas, ids=ids)
-            print(f"[INFO] Successfully added/updated {len(documents)} documents in ChromaDB")
+            self.collection.delete(ids=[str(doc_id) for doc_id in ids])
+            self._invalidate()
+            logger.info("Deleted %d documents from ChromaDB", len(ids))
         except Exception as e:
-            print(f"[ERROR] Failed to add documents in batch: {e}")
-            print("[INFO] Retrying one by one...")
-            success_count = 0
-            for idx in range(len(ids)):
+            logger.error("Failed to delete documents: %s", e)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    @property
+    def layout(self) -> str:
+        return "collection"
+
+    def document_route(self, document: Dict[str, Any]) -> Optional[str]:
+        # 单集合不分片，没有路由键
+        return None
+
+    @property
+    def index_version(self) -> str:
+        try:
+            with open(os.path.join(self.db_path, INDEX_VERSION_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return "initial"
+
+    def _bump_index_version(self):
+        # 版本号写入文件，其他进程（如 Web 服务）的答案缓存据此判断向量库是否被重建
+        os.makedirs(self.db_path, exist_ok=True)
+        with open(os.path.join(self.db_path, INDEX_VERSION_FILE), "w", encoding="utf-8") as f:
+            f.write(f"{time.time_ns()}")
+
+    def _invalidate(self):
+        self._bump_index_version()
+        self._seen_index_version = self.index_version
+        self._drop_derived_state()
+
+    def _drop_derived_state(self):
+        self.result_cache.clear()
+        with self._bm25_lock:
+            self._bm25 = None
+            self._bm25_unavailable = False
+
+    def _sync_index_version(self):
+        # 向量库可能由其他进程（如离线运行的 build_vector_db.py）重建，
+        # 每次检索前比对版本文件，变化时丢弃结果缓存与 BM25 索引
+        version = self.index_version
+        if version != self._seen_index_version:
+            logger.info("Index version changed (%s -> %s), dropping result cache and BM25 index",
+                        self._seen_index_version, version)
+            self._seen_index_version = version
+            self._drop_derived_state()
+
+    def _get_bm25(self):
+        with self._bm25_lock:
+            if self._bm25 is None and not self._bm25_unavailable:
                 try:
-                    self.collection.upsert(
-                        documents=[contents[idx]],
-                        metadatas=[metadatas[idx]],
-                        ids=[ids[idx]]
-                    )
-                    success_count += 1
-                except Exception as inner_e:
-                    print(f"Error adding doc {idx} (ID: {ids[idx]}): {inner_e}")
-                    try:
-                        self.collection.upsert(
-                            documents=[contents[idx]],
-                            metadatas=[{}],
-                            ids=[ids[idx]]
-                        )
-                        print(f"  -> Added doc {idx} without metadata.")
-                        success_count += 1
-                    except:
-                        print(f"  -> Failed to add doc {idx} even without metadata.")
-            print(f"[INFO] Successfully added {success_count}/{len(documents)} documents one-by-one.")
-
-    def query(self, query_text: str, n_results: int = 3) -> List[Dict]:
+                    self._bm25 = BM25Index.from_chunks_file(self.chunks_path)
+                except Exception as e:
+                    logger.warning("BM25 index unavailable (%s), falling back to vector retrieval", e)
+                    self._bm25_unavailable = True
+            return self._bm25
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            "embedding": self.embedding_cache.stats(),
+            "result": self.result_cache.stats()
+        }
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_queries([text])[0]
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        keys = [normalize_query(text) for text in texts]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        missing = sorted({key for key, emb in zip(keys, embeddings) if emb is None})
+        if missing:
+            computed = {}
+            for key, emb in zip(missing, self.embedding_fn.embed_queries(missing)):
+                computed[key] = [float(x) for x in emb]
+                self.embedding_cache.set(key, computed[key])
+            embeddings = [emb if emb is not None else computed[key] for key, emb in zip(keys, embeddings)]
+        return embeddings
+
+    @staticmethod
+    def _result_key(embedding: List[float], n_results: int, where: Dict = None, mode: str = "vector",
+                    mmr_lambda: float = None, include_embeddings: bool = False):
+        emb_digest = hashlib.sha1(json.dumps(embedding).encode("utf-8")).hexdigest()
+        where_key = json.dumps(where, sort_keys=True, ensure_ascii=False) if where else ""
+        return emb_digest, n_results, where_key, mode, mmr_lambda, include_embeddings
+
+    @staticmethod
+    def _make_result(doc_id: str, content: str, metadata: Dict, similarity: float, embedding=None) -> Dict:
+        metadata = expand_metadata(metadata)
+        result = {
+            'document': {
+                'content': content,
+                'metadata': metadata,
+                'id': doc_id
+            },
+            'similarity': similarity,
+            'content': content,
+            'metadata': metadata
+        }
+        if embedding is not None:
+            result['embedding'] = embedding
+        return result
+
+    @classmethod
+    def _format_results(cls, results: Dict, row: int) -> List[Dict]:
+        formatted_results = []
+        result_ids = results['ids'][row] if results['ids'] else []
+        embeddings = results.get('embeddings')
+        for i in range(len(result_ids)):
+            distance = results['distances'][row][i]
+            similarity = 1 / (1 + distance)
+            formatted_results.append(cls._make_result(
+                results['ids'][row][i],
+                results['documents'][row][i],
+                results['metadatas'][row][i],
+                similarity,
+                embeddings[row][i] if embeddings is not None else None
+            ))
+        return formatted_results
+
+    @staticmethod
+    def _select_mmr(query_embedding: List[float], results: List[Dict], k: int, lambda_mult: float) -> List[Dict]:
+        if len(results) <= 1:
+            return results[:k]
+        order = maximal_marginal_relevance(
+            query_embedding, [r['embedding'] for r in results],
+            [r.get('rerank_relevance', r['similarity']) for r in results], k, lambda_mult
+        )
+        return [results[i] for i in order]
+
+    def mmr(self, query_text: str, results: List[Dict], k: int, lambda_mult: float = 0.7) -> List[Dict]:
+        """对带 embedding 的结果（query(..., include_embeddings=True) 返回）做 MMR 选择，
+        相关度优先取重排序得到的 rerank_relevance，否则沿用 similarity；返回的结果去掉 embedding 字段"""
+        if results and all('embedding' in r for r in results):
+            results = self._select_mmr(self.embed_query(query_text), results, k, lambda_mult)
+        else:
+            results = results[:k]
+        for result in results:
+            result.pop('embedding', None)
+        return results
+
+    def _search(self, query_embeddings: List[List[float]], n_results: int, where: Dict = None,
+                include: List[str] = None, filters: Dict = None) -> List[List[Dict]]:
+        return self._query_collection(self.collection, query_embeddings, n_results, where, include)
+
+    def _query_collection(self, collection, query_embeddings: List[List[float]], n_results: int,
+                          where: Dict = None, include: List[str] = None) -> List[List[Dict]]:
+        results = collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=include or ["documents", "metadatas", "distances"]
+        )
+        return [self._format_results(results, row) for row in range(len(query_embeddings))]
+
+    def _get_documents(self, ids: List[str], where: Dict = None, include: List[str] = None) -> Dict:
+        return self.collection.get(ids=ids, where=where, include=include or ["documents", "metadatas"])
+
+    def _fuse_hybrid(self, query_text: str, vector_results: List[Dict], n_results: int,
+                     where: Dict = None, with_embeddings: bool = False) -> List[Dict]:
+        bm25 = self._get_bm25()
+        if bm25 is None:
+            return vector_results[:n_results]
+        bm25_hits = bm25.search(query_text, top_k=self.hybrid_candidates)
+        bm25_scores = dict(bm25_hits)
+        by_id = {r['document']['id']: r for r in vector_results}
+        fused = reciprocal_rank_fusion(
+            [[r['document']['id'] for r in vector_results], [doc_id for doc_id, _ in bm25_hits]],
+            k=self.rrf_k
+        )
+        missing = [doc_id for doc_id, _ in bm25_hits if doc_id not in by_id]
+        if missing:
+            # 仅被 BM25 命中的块需要回表取正文和元数据，where 过滤在这里同样生效
+            include = ["documents", "metadatas", "embeddings"] if with_embeddings else ["documents", "metadatas"]
+            fetched = self._get_documents(missing, where, include)
+            for i, doc_id in enumerate(fetched['ids']):
+                by_id[doc_id] = self._make_result(doc_id, fetched['documents'][i], fetched['metadatas'][i], None,
+                                                  fetched['embeddings'][i] if with_embeddings else None)
+        best_score = 2.0 / (self.rrf_k + 1)
+        fused_results = []
+        for doc_id, score in fused:
+            result = by_id.get(doc_id)
+            if result is None:
+                continue
+            result['vector_similarity'] = result['similarity']
+            result['bm25_score'] = bm25_scores.get(doc_id, 0.0)
+            result['similarity'] = score / best_score
+            fused_results.append(result)
+            if len(fused_results) >= n_results:
+                break
+        return fused_results
+
+    def query(self, query_text: str, n_results: int = 3, where: Dict = None, mode: str = None,
+              filters: Dict = None, mmr_lambda: float = None, include_embeddings: bool = False) -> List[Dict]:
         if not query_text or not query_text.strip():
-            print("[WARN] Empty query text")
+            logger.warning("Empty query text")
             return []
-        print(f"[INFO] Vector Query: '{query_text}'")
+        logger.debug("Vector query: %r", query_text)
+        results = self.query_many([query_text], n_results=n_results, where=where, mode=mode, filters=filters,
+                                  mmr_lambda=mmr_lambda, include_embeddings=include_embeddings)[0]
+        logger.debug("Found %d results", len(results))
+        return results
+
+    def query_many(self, texts: List[str], n_results: int = 3, where: Dict = None,
+                   mode: str = None, filters: Dict = None, mmr_lambda: float = None,
+                   include_embeddings: bool = False) -> List[List[Dict]]:
+        """批量检索；mmr_lambda 不为空时先多取 mmr_candidates 个候选，再用 ChromaDB 返回的向量做 MMR 去冗余，
+        include_embeddings 为真时结果保留 embedding 字段"""
+        mode = mode or self.retrieval_mode
+        where = where or build_where(filters)
+        outputs = [[] for _ in texts]
+        positions = [i for i, text in enumerate(texts) if text and text.strip()]
+        if not positions:
+            return outputs
+        self._sync_index_version()
         try:
-            print(f"Debug: calling collection.query with text='{query_text}' and n_results={n_results}")
-            results = self.collection.query(query_texts=[query_text], n_results=n_results)
-            print(f"Debug: collection.query returned keys: {results.keys()}")
-            formatted_results = []
-            if not results['ids'] or len(results['ids'][0]) == 0:
-                return []
-            for i in range(len(results['ids'][0])):
-                distance = results['distances'][0][i]
-                similarity = 1 / (1 + distance)
-                formatted_results.append({
-                    'document': {
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'id': results['ids'][0][i]
-                    },
-                    'similarity': similarity,
-                    'content': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i]
-                })
-            print(f"[INFO] Found {len(formatted_results)} results")
-            return formatted_results
+            with tracer.span("embedding", queries=len(positions)):
+                embeddings = self._embed_queries([texts[i] for i in positions])
+            pending = {}
+            for pos, embedding in zip(positions, embeddings):
+                cache_key = self._result_key(embedding, n_results, where, mode, mmr_lambda, include_embeddings)
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    outputs[pos] = copy.deepcopy(cached)
+                else:
+                    # 同一批内的重复问题只检索一次
+                    pending.setdefault(cache_key, (embedding, []))[1].append(pos)
+            if not pending:
+                return outputs
+            keys = list(pending)
+            with_embeddings = mmr_lambda is not None or include_embeddings
+            pool_k = max(n_results, self.mmr_candidates) if mmr_lambda is not None else n_results
+            # 混合检索时向量侧多取一些候选，供与 BM25 排名融合
+            fetch_k = max(pool_k, self.hybrid_candidates) if mode == "hybrid" else pool_k
+            include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else [])
+            logger.debug("Calling collection.query with %d query embeddings and n_results=%d", len(keys), fetch_k)
+            with tracer.span("ann", queries=len(keys), n_results=fetch_k, filtered=bool(where)):
+                rows = self._search([pending[key][0] for key in keys], fetch_k, where, include, filters)
+            for row, key in enumerate(keys):
+                formatted_results = rows[row]
+                if mode == "hybrid":
+                    query_text = texts[pending[key][1][0]]
+                    with tracer.span("bm25_fusion"):
+                        formatted_results = self._fuse_hybrid(query_text, formatted_results, pool_k, where,
+                                                              with_embeddings)
+                if mmr_lambda is not None:
+                    # 直接用检索返回的候选向量，不重新向量化
+                    with tracer.span("mmr", candidates=len(formatted_results)):
+                        formatted_results = self._select_mmr(pending[key][0], formatted_results, n_results, mmr_lambda)
+                if not include_embeddings:
+                    for result in formatted_results:
+                        result.pop('embedding', None)
+                self.result_cache.set(key, copy.deepcopy(formatted_results))
+                for pos in pending[key][1]:
+                    outputs[pos] = copy.deepcopy(formatted_results)
         except Exception as e:
-            print(f"[ERROR] Query failed: {e}")
-            return []
+            logger.error("Query failed: %s", e)
+        return outputs
 
     def load_data(self):
-        count = self.collection.count()
+        count = self.count()
         if count > 0:
-            print(f"[INFO] ChromaDB collection '{self.collection_name}' has {count} documents.")
+            logger.info("ChromaDB collection '%s' has %d documents", self.collection_name, count)
             return True
         else:
-            print(f"[WARN] ChromaDB collection '{self.collection_name}' is empty.")
+            logger.warning("ChromaDB collection '%s' is empty", self.collection_name)
+            return False
+
+class ShardedVectorDB(SimpleVectorDB):
+    """分片模式：按来源或时期把文档路由到多个 Chroma 集合，查询时用线程池并行扇出到各分片再合并 top-k
+
+    所有分片使用同一向量模型与距离空间，1/(1+distance) 在分片之间可直接比较，
+    各分片的 top-k 按该分数合并即是全局 top-k；向量模型与当前不一致的分片不加载，避免混入不可比的分数。
+    单个分片的索引规模只随该来源（时期）增长，分片可在运行时加载或卸载，卸载后不再参与查询。
+    """
+
+    def __init__(self, db_path="./chroma_db", collection_name="zju_history", config_path="config.json", **kwargs):
+        sharding_config = load_config(config_path).get("sharding", {})
+        self.route_by = sharding_config.get("route_by", "source")
+        if self.route_by not in SHARD_ROUTES:
+            raise ValueError(f"Unknown shard route '{self.route_by}', expected one of {SHARD_ROUTES}")
+        self.initial_shards = sharding_config.get("shards") or []
+        self.shards: Dict[str, Any] = {}
+        self._shard_lock = threading.Lock()
+        # 时期按起始年份排序，文档按其最早年份归入所在时期
+        self._periods = sorted(
+            (int(start), name) for name, (start, _) in MetadataExtractor().time_periods.items()
+        ) if self.route_by == "period" else []
+        self._executor = ThreadPoolExecutor(max_workers=sharding_config.get("max_workers", 4),
+                                            thread_name_prefix="zju-shard")
+        super().__init__(db_path=db_path, collection_name=collection_name, config_path=config_path, **kwargs)
+
+    @property
+    def layout(self) -> str:
+        return f"shards:{self.route_by}"
+
+    def _open_collection(self):
+        for key in self.initial_shards or self.available_shards():
+            self.load_shard(key)
+        logger.info("Loaded %d shards routed by %s: %s", len(self.shards), self.route_by, sorted(self.shards))
+        return None
+
+    def _shard_name(self, key: str) -> str:
+        # Chroma 集合名只允许 ASCII，分片键（如中文来源名）取哈希，原值记在集合元数据里
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+        return f"{self.collection_name}_{self.route_by}_{digest}"
+
+    def route(self, metadata: Dict[str, Any]) -> str:
+        if self.route_by == "source":
+            return str(metadata.get("source") or UNKNOWN_SOURCE_SHARD)
+        year = metadata.get("start_year")
+        if year is None or not self._periods:
+            return UNDATED_SHARD
+        key = self._periods[0][1]
+        for start, name in self._periods:
+            if year >= start:
+                key = name
+        return key
+
+    def document_route(self, document: Dict[str, Any]) -> Optional[str]:
+        return self.route(flatten_metadata(document))
+
+    def _shard_collection(self, key: str):
+        # 未加载的分片也直接打开集合，供删除使用
+        collection = self._loaded_shards([key]).get(key)
+        if collection is not None:
+            return collection
+        try:
+            return self.client.get_collection(name=self._shard_name(key))
+        except Exception:
+            return None
+
+    def _shard_collections(self, route_by: str):
+        prefix = f"{self.collection_name}_{route_by}_"
+        for collection in self.client.list_collections():
+            # chromadb 0.6 只返回集合名，其他版本返回集合对象
+            name = collection if isinstance(collection, str) else collection.name
+            if name.startswith(prefix):
+                yield self.client.get_collection(name=name) if isinstance(collection, str) else collection
+
+    def available_shards(self) -> List[str]:
+        return sorted(
+            collection.metadata["shard_key"] for collection in self._shard_collections(self.route_by)
+            if collection.metadata and collection.metadata.get("shard_key")
+        )
+
+    def load_shard(self, key: str, create: bool = False) -> bool:
+        with self._shard_lock:
+            if key in self.shards:
+                return True
+            name = self._shard_name(key)
+            try:
+                try:
+                    collection = self.client.get_collection(name=name, embedding_function=self.embedding_fn)
+                except Exception:
+                    collection = self.client.get_collection(name=name)
+            except Exception:
+                if not create:
+                    logger.warning("Shard '%s' does not exist", key)
+                    return False
+                collection = self.client.create_collection(
+                    name=name,
+                    embedding_function=self.embedding_fn,
+                    metadata={"shard_key": key, "route_by": self.route_by, "embedding_model": self.embedding_model_id}
+                )
+            shard_model = (collection.metadata or {}).get("embedding_model")
+            if shard_model != self.embedding_model_id:
+                logger.warning("Shard '%s' was built with %s, not %s; run build_vector_db.py to re-embed it",
+                               key, shard_model, self.embedding_model_id)
+                return False
+            self.shards[key] = collection
+        self.result_cache.clear()
+        logger.info("Shard '%s' loaded (%s)", key, name)
+        return True
+
+    def unload_shard(self, key: str) -> bool:
+        with self._shard_lock:
+            collection = self.shards.pop(key, None)
+        if collection is None:
             return False
+        self.result_cache.clear()
+        logger.info("Shard '%s' unloaded", key)
+        return True
+
+    def _loaded_shards(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        with self._shard_lock:
+            if keys is None:
+                return dict(self.shards)
+            return {key: self.shards[key] for key in keys if key in self.shards}
+
+    def shard_stats(self) -> Dict[str, int]:
+        return {key: collection.count() for key, collection in self._loaded_shards().items()}
+
+    def count(self) -> int:
+        return sum(self.shard_stats().values())
+
+    def reset_collection(self):
+        # 其他路由方式留下的分片一并删除，切换 route_by 后全量重建不会残留旧分片
+        for route_by in SHARD_ROUTES:
+            for collection in list(self._shard_collections(route_by)):
+                try:
+                    self.client.delete_collection(name=collection.name)
+                except Exception as e:
+                    logger.warning("Failed to delete shard collection '%s': %s", collection.name, e)
+        with self._shard_lock:
+            self.shards.clear()
+        self._invalidate()
+        logger.info("All %s shards of '%s' reset for %s", self.route_by, self.collection_name, self.embedding_model_id)
+
+    def _write_batch(self, ids, contents, metadatas, embeddings) -> List[str]:
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(self.route(metadata), []).append(i)
+        written = []
+        for key, rows in groups.items():
+            if not self.load_shard(key, create=True):
+                logger.error("Skipping %d documents routed to unavailable shard '%s'", len(rows), key)
+                continue
+            written.extend(self._upsert_batch(
+                self.shards[key], [ids[i] for i in rows], [contents[i] for i in rows], [metadatas[i] for i in rows],
+                [embeddings[i] for i in rows] if embeddings is not None else None
+            ))
+        return written
+
+    def delete_documents(self, ids: List[str], routes: Dict[str, str] = None):
+        """routes 给出文档所在分片时只从该分片删除（分片未加载也会处理），其余文档从所有已加载分片删除"""
+        if not ids:
+            return
+        routes = routes or {}
+        by_shard: Dict[str, List[str]] = {}
+        unrouted = []
+        for doc_id in map(str, ids):
+            if routes.get(doc_id) is None:
+                unrouted.append(doc_id)
+            else:
+                by_shard.setdefault(routes[doc_id], []).append(doc_id)
+        try:
+            for key, shard_ids in by_shard.items():
+                collection = self._shard_collection(key)
+                if collection is not None:
+                    collection.delete(ids=shard_ids)
+            if unrouted:
+                for collection in self._loaded_shards().values():
+                    collection.delete(ids=unrouted)
+            self._invalidate()
+            logger.info("Deleted %d documents from ChromaDB shards", len(ids))
+        except Exception as e:
+            logger.error("Failed to delete documents: %s", e)
+
+    def _target_shards(self, filters: Dict = None) -> List[str]:
+        # 过滤条件与路由键相关时只查询可能命中的分片
+        keys = list(self._loaded_shards())
+        if not filters:
+            return keys
+        if self.route_by == "source" and filters.get("source"):
+            return [key for key in keys if key == filters["source"]]
+        if self.route_by == "period" and filters.get("year_range"):
+            end = int(filters["year_range"][1])
+            # 早于首个时期的年份也归入首个时期；未标注年代的文档没有年份，不会命中年份过滤
+            starts = {name: start if i else float("-inf") for i, (start, name) in enumerate(self._periods)}
+            return [key for key in keys if starts.get(key, float("inf")) <= end]
+        return keys
+
+    def _search(self, query_embeddings: List[List[float]], n_results: int, where: Dict = None,
+                include: List[str] = None, filters: Dict = None) -> List[List[Dict]]:
+        shards = self._loaded_shards(self._target_shards(filters))
+        merged = [[] for _ in query_embeddings]
+        with tracer.span("shard_fanout", shards=len(shards)):
+            futures = {
+                key: self._executor.submit(self._query_collection, collection, query_embeddings, n_results, where, include)
+                for key, collection in shards.items()
+            }
+            for key, future in futures.items():
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    logger.warning("Query on shard '%s' failed: %s", key, e)
+                    continue
+                for row, results in enumerate(rows):
+                    for result in results:
+                        result['shard'] = key
+                    merged[row].extend(results)
+        return [sorted(results, key=lambda result: result['similarity'], reverse=True)[:n_results]
+                for results in merged]
+
+    def _get_documents(self, ids: List[str], where: Dict = None, include: List[str] = None) -> Dict:
+        include = include or ["documents", "metadatas"]
+        merged = {"ids": [], **{field: [] for field in include}}
+        for collection in self._loaded_shards().values():
+            fetched = collection.get(ids=ids, where=where, include=include)
+            for field in merged:
+                if fetched.get(field) is not None:
+                    merged[field].extend(fetched[field])
+        return merged
+
+def create_vector_db(config_path: str = "config.json", **kwargs) -> SimpleVectorDB:
+    """配置 sharding.enabled 为真时返回 ShardedVectorDB，否则返回单集合的 SimpleVectorDB"""
+    if load_config(config_path).get("sharding", {}).get("enabled", False):
+        return ShardedVectorDB(config_path=config_path, **kwargs)
+    return SimpleVectorDB(config_path=config_path, **kwargs)
@@ -1,48 +1,239 @@
+import time
+_process_start = time.perf_counter()
 import gradio as gr
 import json
 import re
 import os
+import asyncio
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from vector_db import SimpleVectorDB
-from llm_client import LLMGenerator
+from app_config import load_config
+from tracing import tracer
+from log_utils import get_logger, setup_logging
+# 日志在 setup_logging 之后才输出，这里只记录导入耗时
+GRADIO_IMPORT_SECONDS = time.perf_counter() - _process_start
+
+# 检索组件尚未就绪时，请求最多等待的秒数
+STARTUP_WAIT = 120
+logger = get_logger("web_app")
 
 class EnhancedZJUHistorySystem:
-    def __init__(self):
-        self.vector_db = SimpleVectorDB()
-        self.llm = LLMGenerator()
-        self.load_database()
+    def __init__(self, background=False):
+        self.config = load_config()
+        self.vector_db = None
+        self.llm = None
+        self.metadata_extractor = None
+        self.answer_cache = None
+        self.chunk_store = None
+        self.reranker = None
+        self.split_thinking = None
+        self.generation_status = None
         self.query_history = []
+        # ready：检索组件加载完成（无论成功与否）；llm_ready：LLM 预热完成
+        self.ready = threading.Event()
+        self.llm_ready = threading.Event()
+        self.startup_error = None
+        self.llm_warmed = None
+        self.startup_timings = {}
+        setup_logging(self.config.get("logging"))
+        logger.info("[Startup] import gradio: %.2fs", GRADIO_IMPORT_SECONDS)
+        tracer.configure(self.config.get("tracing", {}))
+        if background:
+            # 先让 Web 服务绑定端口，向量模型、Chroma 与 LLM 客户端在后台线程加载
+            threading.Thread(target=self.initialize, name="zju-startup", daemon=True).start()
+        else:
+            self.initialize()
+
+    @contextmanager
+    def _timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.startup_timings[name] = elapsed
+            logger.info("[Startup] %s: %.2fs", name, elapsed)
+
+    def initialize(self):
+        started = time.perf_counter()
+        try:
+            # chromadb、openai 等依赖导入较慢，推迟到这里再加载
+            with self._timed("import vector_db (chromadb)"):
+                from vector_db import create_vector_db
+            with self._timed("import llm_client (openai)"):
+                from llm_client import GenerationStatus, LLMGenerator, split_thinking
+                self.split_thinking = split_thinking
+                self.generation_status = GenerationStatus
+            with self._timed("import metadata/cache modules"):
+                from data_processing.metadata_extractor import MetadataExtractor
+                from data_processing.chunk_store import open_chunk_store
+            with self._timed("import reranker (sentence-transformers)"):
+                from reranker import CrossEncoderReranker
+            with self._timed("vector_db"):
+                self.vector_db = create_vector_db()
+            with self._timed("llm_client"):
+                self.llm = LLMGenerator()
+            with self._timed("metadata_extractor"):
+                self.metadata_extractor = MetadataExtractor()
+            with self._timed("answer_cache"):
+                self.answer_cache = self._create_answer_cache()
+            with self._timed("reranker"):
+                self.reranker = CrossEncoderReranker.from_config(self.config.get("rerank", {}))
+            with self._timed("chunk_store"):
+                self.chunk_store = open_chunk_store(self.vector_db.chunk_store_path, self.vector_db.chunks_path)
+            self.load_database()
+            if self.config.get("web", {}).get("warm_up", True):
+                with self._timed("warm-up retrieval"):
+                    # 一次真实检索：加载向量模型权重、HNSW 索引与 BM25 倒排索引
+                    warm_up_results = self.vector_db.query("浙江大学的前身是什么？", n_results=1)
+                    if self.reranker:
+                        self.reranker.rerank("浙江大学的前身是什么？", warm_up_results, 1)
+        except Exception as e:
+            self.startup_error = str(e)
+            logger.error("Startup failed: %s", e)
+        finally:
+            logger.info("[Startup] retrieval ready in %.2fs", time.perf_counter() - started)
+            self.ready.set()
+        try:
+            if self.llm and self.config.get("web", {}).get("warm_up", True):
+                with self._timed("warm-up llm"):
+                    self.llm_warmed = self.llm.warm_up()
+        finally:
+            self.llm_ready.set()
+
+    def is_ready(self):
+        return self.ready.is_set() and self.vector_db is not None
+
+    def startup_finished(self):
+        return self.ready.is_set() and self.llm_ready.is_set()
+
+    def status_text(self):
+        if not self.ready.is_set():
+            return "⏳ 正在加载检索模型与向量库..."
+        if self.vector_db is None:
+            return f"❌ 启动失败：{self.startup_error}"
+        if not self.llm_ready.is_set():
+            return "🟡 检索已就绪，正在预热语言模型..."
+        if self.llm_warmed is False:
+            return "🟠 检索已就绪，语言模型预热失败，请检查 LLM 服务"
+        return "🟢 系统已就绪"
+
+    def _create_answer_cache(self):
+        cache_config = self.config.get("answer_cache", {})
+        if not cache_config.get("enabled", True):
+            return None
+        from answer_cache import SemanticAnswerCache
+        return SemanticAnswerCache(
+            cache_config.get("path") or os.path.join(self.vector_db.db_path, "answer_cache.sqlite"),
+            similarity_threshold=cache_config.get("similarity_threshold", 0.95),
+            max_entries=cache_config.get("max_entries", 1000)
+        )
 
     def load_database(self):
         if not self.vector_db.load_data():
-            print("请先构建向量数据库！")
+            logger.warning("请先构建向量数据库！")
             return False
-        print("向量数据库加载成功！")
+        logger.info("向量数据库加载成功！")
         return True
 
-    def smart_query(self, question, top_k=3):
-        if not question.strip():
-            return "请输入问题", []
-        keywords = self.extract_keywords(question)
-        intent = self.understand_intent(question)
-        print(f"[Query] Keywords: {keywords}, Intent: {intent}")
-        results = self.vector_db.query(question, n_results=top_k)
-        if not results and keywords:
-            for keyword in keywords[:2]:
-                results = self.vector_db.query(keyword, n_results=top_k)
-                if results:
-                    break
+    def retrieve(self, question, top_k=3):
+        with tracer.span("extract_keywords"):
+            keywords = self.extract_keywords(question)
+        with tracer.span("understand_intent"):
+            intent = self.understand_intent(question)
+        filters = self.build_filters(question, keywords, intent)
+        logger.debug("Keywords: %s, Intent: %s, Filters: %s", keywords, intent, filters)
+        # 启用重排序时多取候选，由交叉编码器选出最终的 top_k
+        fetch_k = max(top_k, self.config.get("rerank", {}).get("candidates", 20)) if self.reranker else top_k
+        # MMR 去冗余：无重排序时由向量库在检索内完成；有重排序时保留候选向量，重排序后再选
+        mmr_lambda = self.config.get("retrieval", {}).get("mmr_lambda")
+        if self.reranker:
+            query_options = {"include_embeddings": mmr_lambda is not None}
+        else:
+            query_options = {"mmr_lambda": mmr_lambda}
+        results = []
+        if filters:
+            with tracer.span("vector_query", filtered=True):
+                results = self.vector_db.query(question, n_results=fetch_k, filters=filters, **query_options)
+        if not results:
+            with tracer.span("vector_query", filtered=False):
+                results = self.vector_db.query(question, n_results=fetch_k, **query_options)
+        # 混合检索已由 BM25 覆盖关键词匹配，无需再逐个关键词回退查询
+        if not results and keywords and self.vector_db.retrieval_mode != "hybrid":
+            with tracer.span("keyword_fallback", keywords=len(keywords[:2])):
+                for keyword_results in self.vector_db.query_many(keywords[:2], n_results=fetch_k, **query_options):
+                    if keyword_results:
+                        results = keyword_results
+                        break
+        if results and self.reranker:
+            with tracer.span("rerank") as rerank_stats:
+                results = self.reranker.rerank(question, results, len(results) if mmr_lambda is not None else top_k,
+                                               stats=rerank_stats)
+            if mmr_lambda is not None:
+                with tracer.span("mmr", candidates=len(results)):
+                    results = self.vector_db.mmr(question, results, top_k, mmr_lambda)
+        else:
+            results = results[:top_k]
         self.query_history.append({
             "question": question,
             "time": datetime.now().isoformat(),
             "results_count": len(results) if results else 0
         })
-        if not results:
-            response = self.generate_no_results_response(question, keywords)
-            yield response, []
+        trace = tracer.current()
+        if trace is not None:
+            trace.attributes.update({"intent": intent, "results": len(results) if results else 0})
+        return results, keywords, intent
+
+    def smart_query(self, question, top_k=3):
+        if not question.strip():
+            yield "请输入问题", []
+            return
+        # 生成器会在不同线程中逐步推进，trace 显式传递，只在不跨 yield 的代码块内设为当前追踪
+        trace = tracer.start_trace("smart_query", question_length=len(question))
+        status = "ok"
+        try:
+            with tracer.activate(trace), tracer.span("retrieve"):
+                results, keywords, intent = self.retrieve(question, top_k)
+            if not results:
+                response = self.generate_no_results_response(question, keywords)
+                yield response, []
+                return
+            for partial_response in self.generate_response(question, results, intent, trace=trace):
+                yield partial_response, results
+        except GeneratorExit:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            tracer.finish(trace, status)
+
+    async def asmart_query(self, question, top_k=3):
+        if not question.strip():
+            yield "请输入问题", []
             return
-        for partial_response in self.generate_response(question, results, intent):
-            yield partial_response, results
+        trace = tracer.start_trace("smart_query", question_length=len(question))
+        status = "ok"
+        try:
+            # 检索是 CPU 密集的同步调用，放到线程里执行以免阻塞事件循环；to_thread 会带上当前追踪上下文
+            with tracer.activate(trace), tracer.span("retrieve"):
+                results, keywords, intent = await asyncio.to_thread(self.retrieve, question, top_k)
+            if not results:
+                response = self.generate_no_results_response(question, keywords)
+                yield response, []
+                return
+            async for partial_response in self.agenerate_response(question, results, intent, trace=trace):
+                yield partial_response, results
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            tracer.finish(trace, status)
 
     def extract_keywords(self, question):
         zju_entities = [
@@ -62,6 +253,23 @@ class EnhancedZJUHistorySystem:
         keywords.extend([word for word in chinese_words if word not in keywords])
         return keywords
 
+    def build_filters(self, question, keywords, intent):
+        # 只按问题意图收窄候选集；过滤后无结果时 smart_query 会退回全库检索
+        filters = {}
+        if intent == "person":
+            persons = [p for p in self.metadata_extractor.important_figures if p in question]
+            if persons:
+                filters["persons"] = persons
+        elif intent == "location":
+            locations = [l for l in self.metadata_extractor.locations if l in question]
+            if locations:
+                filters["locations"] = locations
+        elif intent == "time":
+            years = [int(k[:4]) for k in keywords if re.fullmatch(r'\d{4}年', k)]
+            if years:
+                filters["year_range"] = (min(years), max(years))
+        return filters
+
     def understand_intent(self, question):
         q = question.lower()
         if any(word in q for word in ['什么时候', '何时', '哪一年', '成立时间']):
@@ -93,19 +301,25 @@ class EnhancedZJUHistorySystem:
         response += "- 各时期的重要成就和特色\n"
         return response
 
-    def generate_response(self, question, results, intent):
+    def generate_response(self, question, results, intent, trace=None):
         if self.llm.client:
-            print("[Info] Using LLM for generation...")
+            logger.debug("Using LLM for generation")
+            citations = self.format_citations(results)
+            with tracer.span("answer_cache_lookup", trace=trace):
+                cache_entry = self.lookup_cached_answer(question, results)
+            if trace is not None:
+                trace.attributes["answer_cache_hit"] = cache_entry[2] is not None
+            if cache_entry[2] is not None:
+                yield from self.replay_answer(cache_entry[2], citations)
+                return
             context_chunks = [r['document'] for r in results]
-            response_text = self.llm.generate_answer(question, context_chunks, stream=False)
-            if not isinstance(response_text, str):
-                response_text = str(response_text)
-            citations = "\n\n" + "─" * 30 + "\n**参考来源：**\n"
-            for i, result in enumerate(results):
-                meta = result['document'].get('metadata', {})
-                source = meta.get('section_title') or meta.get('source') or '未知章节'
-                citations += f"[{i+1}] {source} (相关度: {result['similarity']:.2f})\n"
-            yield response_text + citations
+            response_text = ""
+            status = self.generation_status()
+            for token in self.llm.generate_answer(question, context_chunks, stream=True, trace=trace, status=status):
+                response_text += token
+                yield self.render_answer(response_text)
+            self.store_answer(question, cache_entry, response_text, status)
+            yield self.render_answer(response_text) + citations
             return
         response = f"关于『{question}』，我找到了以下信息：\n\n"
         if intent == "time":
@@ -123,7 +337,7 @@ class EnhancedZJUHistorySystem:
             meta = result['document'].get('metadata', {})
             src = meta.get('section_title') or meta.get('source') or '未知章节'
             response += f"来源：{src}\n"
-            response += f"相关度：{result['similarity']:.4f}\n"
+            response += f"相关度：{self.relevance(result):.4f}\n"
             response += f"内容：{result['content']}\n"
             metadata = result['document'].get('metadata', {})
             if metadata.get('persons'):
@@ -137,36 +351,106 @@ class EnhancedZJUHistorySystem:
             response += "提示：如果这不是您想要的信息，可以尝试更具体的问题描述。"
         yield response
 
+    async def agenerate_response(self, question, results, intent, trace=None):
+        if not self.llm.client:
+            for partial_response in self.generate_response(question, results, intent, trace=trace):
+                yield partial_response
+            return
+        citations = self.format_citations(results)
+        with tracer.span("answer_cache_lookup", trace=trace):
+            cache_entry = self.lookup_cached_answer(question, results)
+        if trace is not None:
+            trace.attributes["answer_cache_hit"] = cache_entry[2] is not None
+        if cache_entry[2] is not None:
+            interval = self.config.get("answer_cache", {}).get("replay_interval", 0.02)
+            for partial_response in self.replay_answer(cache_entry[2], citations):
+                yield partial_response
+                await asyncio.sleep(interval)
+            return
+        context_chunks = [r['document'] for r in results]
+        response_text = ""
+        status = self.generation_status()
+        async for token in self.llm.agenerate_answer(question, context_chunks, trace=trace, status=status):
+            response_text += token
+            yield self.render_answer(response_text)
+        self.store_answer(question, cache_entry, response_text, status)
+        yield self.render_answer(response_text) + citations
+
+    def lookup_cached_answer(self, question, results):
+        if self.answer_cache is None:
+            return None, None, None
+        params = self.llm.completion_params()
+        context_key = self.answer_cache.make_context_key(
+            [r['document']['id'] for r in results], params["model"], params["temperature"]
+        )
+        embedding = self.vector_db.embed_query(question)
+        answer = self.answer_cache.lookup(embedding, context_key, self.vector_db.index_version)
+        if answer is not None:
+            logger.debug("Answer cache hit")
+        return context_key, embedding, answer
+
+    def store_answer(self, question, cache_entry, response_text, status):
+        context_key, embedding, _ = cache_entry
+        # 只缓存完整生成的回答，报错、排队超时或被截断的回答不缓存
+        if context_key is None or not response_text or not status.completed:
+            return
+        self.answer_cache.store(question, embedding, context_key, self.vector_db.index_version, response_text)
+
+    def replay_answer(self, answer, citations="", frames=12):
+        # 以流的形式回放缓存答案，前端表现与实时生成一致；短答案同样分帧，最后一帧为完整答案与引用
+        step = max(1, -(-len(answer) // frames))
+        for end in range(step, len(answer), step):
+            yield self.render_answer(answer[:end])
+        yield self.render_answer(answer) + citations
+
+    @staticmethod
+    def relevance(result):
+        # 经过重排序的结果展示交叉编码器相关度，否则展示检索得分
+        return result.get('rerank_relevance', result['similarity'])
+
+    def format_citations(self, results):
+        citations = "\n\n" + "─" * 30 + "\n**参考来源：**\n"
+        for i, result in enumerate(results):
+            meta = result['document'].get('metadata', {})
+            source = meta.get('section_title') or meta.get('source') or '未知章节'
+            # 分块存储按 id 直接定位原始分块，补充文件名与来源信息
+            chunk_meta = self.chunk_store.get_meta(result['document'].get('id', '')) if self.chunk_store else None
+            if chunk_meta:
+                source = f"{chunk_meta.get('filename', '文档')} - {chunk_meta.get('source', '内容')}"
+            citations += f"[{i+1}] {source} (相关度: {self.relevance(result):.2f})\n"
+        return citations
+
+    def render_answer(self, text):
+        thinking, answer, thinking_done = self.split_thinking(text)
+        collapse = self.config.get("llm", {}).get("thinking", "collapse") == "collapse"
+        if not thinking_done:
+            if collapse and thinking:
+                return f"<details open><summary>正在思考...</summary>\n\n{thinking}\n\n</details>"
+            return "正在思考..."
+        if thinking and collapse:
+            return f"<details><summary>思考过程</summary>\n\n{thinking}\n\n</details>\n\n{answer}"
+        return answer
+
     def get_system_stats(self):
-        if hasattr(self.vector_db, 'documents'):
-            total_chunks = len(self.vector_db.documents)
-            total_chars = sum(len(doc['content']) for doc in self.vector_db.documents)
-            time_periods = set()
-            persons = set()
-            locations = set()
-            institutions = set()
-            for doc in self.vector_db.documents:
-                metadata = doc.get('metadata', {})
-                time_periods.update(metadata.get('time_periods', []))
-                persons.update(metadata.get('persons', []))
-                locations.update(metadata.get('locations', []))
-                institutions.update(metadata.get('institutions', []))
-            stats = f"""
+        if not self.chunk_store or not len(self.chunk_store):
+            return "无法获取统计信息"
+        stats = self.chunk_store.stats()
+        entities = stats['entities']
+        return f"""
 系统统计信息
 
 数据规模：
-• 文本块数量：{total_chunks} 个
-• 总字符数：{total_chars} 字
-• 平均块大小：{total_chars/total_chunks:.0f} 字
+• 文本块数量：{stats['total_chunks']} 个
+• 总字符数：{stats['total_chars']} 字
+• 平均块大小：{stats['avg_chunk_size']:.0f} 字
+• 平均质量分：{stats['avg_quality']:.2f}
 
 内容覆盖：
-• 时间范围：{len(time_periods)} 个时间段
-• 涉及人物：{len(persons)} 位
-• 相关地点：{len(locations)} 处  
-• 机构组织：{len(institutions)} 个
+• 时间范围：{entities.get('time_periods', 0) + entities.get('periods', 0)} 个时间段
+• 涉及人物：{entities.get('persons', 0)} 位
+• 相关地点：{entities.get('locations', 0)} 处  
+• 机构组织：{entities.get('institutions', 0)} 个
 """
-            return stats
-        return "无法获取统计信息"
 
     def get_suggested_questions(self):
         suggestions = [
@@ -184,13 +468,22 @@ class EnhancedZJUHistorySystem:
         return suggestions
 
 def create_enhanced_web_interface():
-    system = EnhancedZJUHistorySystem()
-    def respond(question, chat_history):
+    config = load_config()
+    system = EnhancedZJUHistorySystem(background=config.get("web", {}).get("background_startup", True))
+    async def respond(question, chat_history):
         formatted_history = []
         formatted_history.append({"role": "user","content": question})
         formatted_history.append({"role": "assistant","content": "正在思考..."})
         yield formatted_history, ""
-        for response, results in system.smart_query(question):
+        if not system.ready.is_set():
+            formatted_history[-1]["content"] = "系统正在加载检索模型，请稍候..."
+            yield formatted_history, ""
+            await asyncio.to_thread(system.ready.wait, STARTUP_WAIT)
+        if not system.is_ready():
+            formatted_history[-1]["content"] = system.status_text()
+            yield formatted_history, ""
+            return
+        async for response, results in system.asmart_query(question):
             formatted_history[-1]["content"] = response
             yield formatted_history, ""
     def show_stats():
@@ -202,6 +495,7 @@ def create_enhanced_web_interface():
         return [], ""
     with gr.Blocks(title="浙江大学校史智能问答系统", theme=gr.themes.Soft()) as demo:
         gr.Markdown("# 浙江大学校史智能问答系统")
+        startup_status = gr.Markdown(system.status_text())
         with gr.Row():
             with gr.Column(scale=2):
                 chatbot = gr.Chatbot(label="校史问答对话", height=500, show_copy_button=True, type="messages")
@@ -233,20 +527,30 @@ def create_enhanced_web_interface():
         clear_btn.click(clear_chat, None, [chatbot, question])
         stats_btn.click(show_stats, None, stats_output)
         suggest_btn.click(get_suggestions, None, suggestions_output)
+        # 启动期间每秒刷新状态，检索与语言模型都就绪后停用定时器，不再轮询服务端
+        status_timer = gr.Timer(1, active=not system.startup_finished())
+
+        def refresh_status():
+            return system.status_text(), gr.Timer(active=not system.startup_finished())
+
+        status_timer.tick(refresh_status, None, [startup_status, status_timer])
+        demo.load(refresh_status, None, [startup_status, status_timer])
+    # 生成并发由 LLMGenerator 的信号量控制，这里只限制同时处理的会话数
+    demo.queue(default_concurrency_limit=config.get("web", {}).get("concurrency_limit", 32))
     return demo
 
 if __name__ == "__main__":
     demo = create_enhanced_web_interface()
-    print("[INFO] Starting Web UI...")
+    logger.info("Starting Web UI...")
     port_env = os.environ.get("GRADIO_SERVER_PORT")
     port = int(port_env) if port_env and port_env.isdigit() else None
     try:
-        demo.launch(server_name="127.0.0.1", server_port=port, share=False, inbrowser=False)
+        demo.launch(server_name="127.0.0.1", server_port=port, share=False, inbrowser=False, prevent_thread_lock=True)
     except OSError:
-        demo.launch(server_name="127.0.0.1", server_port=None, share=False, inbrowser=False)
-    import time
+        demo.launch(server_name="127.0.0.1", server_port=None, share=False, inbrowser=False, prevent_thread_lock=True)
+    logger.info("[Startup] server listening after %.2fs", time.perf_counter() - _process_start)
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("Stopping...")
+        logger.info("Stopping...")